@@ -0,0 +1,86 @@
+#!/usr/bin/env python3.6
+"""Measure how many bytes each actor, particle and map cell takes up.
+
+Usage::
+
+    python benchmarks/memory.py [--count N] [--output FILE]
+
+This creates N objects of each class in a headless game, and uses
+tracemalloc to see how much memory they allocated between them, including
+their attribute dicts and anything else that each instance owns.
+"""
+from __future__ import absolute_import
+import argparse
+import json
+import os
+import platform
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+import deathbeam  # noqa: E402,F401 (must come before pyglet.window)
+from deathbeam.aliens import Turret  # noqa: E402
+from deathbeam.game import Game  # noqa: E402
+from deathbeam.humans import Civilian, Rocket  # noqa: E402
+from deathbeam.particles import Arrow, Text, TurretBullet  # noqa: E402
+from deathbeam.worlds import MapCell  # noqa: E402
+
+
+ACTOR_CLASSES = (Civilian, Rocket, Turret, Arrow, Text, TurretBullet)
+
+
+def measure(create, count):
+    """Get the average number of bytes allocated by a call to create()."""
+    objects = []
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for i in range(count):
+        objects.append(create(i))
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # Don't count the list that's holding on to them.
+    after -= sys.getsizeof(objects)
+    return (after - before) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=5000)
+    parser.add_argument('--output', help='write JSON here, not to stdout')
+    args = parser.parse_args()
+
+    game = Game(headless=True, seed=0)
+    results = {
+        'python': platform.python_version(),
+        'bytes_per_object': {},
+    }
+    sizes = results['bytes_per_object']
+    for cls in ACTOR_CLASSES:
+        if cls is Text:
+            def create(i):
+                return Text(game, 'TEXT', 100.0, 100.0)
+        else:
+            def create(i, cls=cls):
+                return cls(game, 100.0, 100.0)
+        sizes[cls.__name__] = measure(create, args.count)
+
+    map = game.world.map
+    cells = map.width * map.height
+
+    def create_cell(i):
+        return MapCell(map, i % map.width, i // map.width)
+    sizes['MapCell'] = measure(create_cell, cells)
+    results['map_cells'] = cells
+    results['map_grid_bytes'] = sum(
+        sys.getsizeof(grid) for grid in (map.tiles, map.types, map.bounds))
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3.6
+"""Run the scripted benchmark scenarios and print the results as JSON.
+
+Usage::
+
+    python benchmarks/run.py [--ticks N] [--seed N] [--output FILE] [NAME...]
+
+Each scenario runs in a headless game with a fixed seed, so two runs of the
+same tree should do exactly the same work. The game keeps ticking even if
+it ends part way through, so every run covers the same number of ticks.
+"""
+from __future__ import absolute_import
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+import deathbeam  # noqa: E402,F401 (must come before pyglet.window)
+from deathbeam.game import Game  # noqa: E402
+from scenarios import iter_registered_scenarios  # noqa: E402
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    i = int(round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[i]
+
+
+def run_scenario(cls, ticks=None, seed=0):
+    """Run a single scenario.
+
+    :param cls: Scenario class to run.
+    :param int ticks: Number of ticks to run, or None for the scenario's
+        default.
+    :param int seed: Random seed for the game.
+    :returns: dict of results.
+    """
+    ticks = ticks or cls.TICKS
+    game = Game(headless=True, seed=seed)
+    scenario = cls(game)
+    scenario.setup()
+    durations = []
+    peak_actors = peak_particles = 0
+    perf_counter = time.perf_counter
+    try:
+        for tick in range(ticks):
+            scenario.update(tick)
+            start = perf_counter()
+            game.tick()
+            durations.append(perf_counter() - start)
+            if len(game.actors) > peak_actors:
+                peak_actors = len(game.actors)
+            particles = len(game.particles) + len(game.particle_engine)
+            if particles > peak_particles:
+                peak_particles = particles
+    finally:
+        scenario.teardown()
+        game.close()
+    elapsed = sum(durations)
+    durations.sort()
+    return {
+        'ticks': ticks,
+        'seconds': elapsed,
+        'ticks_per_second': ticks / elapsed if elapsed else 0.0,
+        'tick_ms_p50': percentile(durations, 0.5) * 1000.0,
+        'tick_ms_p99': percentile(durations, 0.99) * 1000.0,
+        'tick_ms_max': durations[-1] * 1000.0 if durations else 0.0,
+        'peak_actors': peak_actors,
+        'peak_particles': peak_particles,
+        'particle_high_water': {
+            name: stats['high_water']
+            for name, stats in sorted(game.particle_stats().items())},
+    }
+
+
+def main():
+    scenarios = {cls.NAME: cls for cls in iter_registered_scenarios()}
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('names', metavar='NAME', nargs='*',
+                        help='scenarios to run: {} (default: all)'.format(
+                            ', '.join(scenarios)))
+    parser.add_argument('--output', help='write JSON here, not to stdout')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--ticks', type=int,
+                        help="override each scenario's tick count")
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in scenarios:
+            parser.error('unknown scenario: {}'.format(name))
+
+    results = {
+        'python': platform.python_version(),
+        'seed': args.seed,
+        'scenarios': {},
+    }
+    for name, cls in scenarios.items():
+        if args.names and name not in args.names:
+            continue
+        logging.info('running %s', name)
+        result = run_scenario(cls, args.ticks, args.seed)
+        logging.info('%s: %.1f ticks/s, p50 %.3fms, p99 %.3fms', name,
+                     result['ticks_per_second'], result['tick_ms_p50'],
+                     result['tick_ms_p99'])
+        results['scenarios'][name] = result
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)-15s\t%(levelname)s\t%(message)s',
+                        level=logging.INFO)
+    main()
@@ -0,0 +1,128 @@
+"""Scripted scenarios for the benchmarks.
+
+Each scenario sets up a headless game, and then pokes at it before every
+tick, usually by holding down keys for the player.
+"""
+from __future__ import absolute_import
+
+from pyglet.window.key import LEFT, RIGHT, SPACE
+
+from deathbeam import defs
+from deathbeam.aliens import Turret
+
+
+_scenario_classes = []
+
+
+def iter_registered_scenarios():
+    for cls in _scenario_classes:
+        yield cls
+
+
+def register_scenario(cls):
+    _scenario_classes.append(cls)
+    return cls
+
+
+class Scenario(object):
+
+    NAME = None
+    TICKS = 2000
+
+    def __init__(self, game):
+        self.game = game
+
+    def setup(self):
+        pass
+
+    def teardown(self):
+        pass
+
+    def update(self, tick):
+        pass
+
+
+@register_scenario
+class Idle(Scenario):
+
+    """Nobody touches anything, as a baseline for the others."""
+
+    NAME = 'idle'
+
+
+@register_scenario
+class Jetpack(Scenario):
+
+    """Hold the jetpack down for 60 seconds, drifting back and forth."""
+
+    NAME = 'jetpack'
+    TICKS = 4000  # 60 seconds at 0.015s per tick
+
+    def update(self, tick):
+        keys = self.game.keys
+        keys[SPACE] = True
+        keys[RIGHT] = (tick // 200) % 2 == 0
+        keys[LEFT] = not keys[RIGHT]
+
+
+@register_scenario
+class Rocket(Scenario):
+
+    """Strap the player to the rocket and launch it."""
+
+    NAME = 'rocket'
+
+    def setup(self):
+        player = self.game.player
+        rocket = self.game.actors_by_type[defs.CELL_HUMAN_ROCKET][0]
+        rocket.on_collide(player, True)
+
+    def update(self, tick):
+        self.game.keys[SPACE] = True
+
+
+@register_scenario
+class Chain(Scenario):
+
+    """Pick up 20 civilians and drag them around the level."""
+
+    NAME = 'chain'
+    CIVILIANS = 20
+
+    def setup(self):
+        player = self.game.player
+        civilians = self.game.actors_by_type[defs.CELL_HUMAN_CIVILIAN]
+        for civilian in list(civilians)[:self.CIVILIANS]:
+            civilian.old_x = civilian.x = player.x
+            civilian.old_y = civilian.y = player.y
+            civilian.attach(player)
+
+    def update(self, tick):
+        keys = self.game.keys
+        keys[SPACE] = (tick // 100) % 3 != 0
+        keys[RIGHT] = (tick // 300) % 2 == 0
+        keys[LEFT] = not keys[RIGHT]
+
+
+@register_scenario
+class Turrets(Scenario):
+
+    """Every turret in the level shoots at the player, wherever they are."""
+
+    NAME = 'turrets'
+
+    def setup(self):
+        self.can_sleep = Turret.CAN_SLEEP
+        self.check_los = Turret.CHECK_LOS
+        self.volley_range = Turret.VOLLEY_RANGE
+        Turret.CAN_SLEEP = False
+        Turret.CHECK_LOS = False
+        Turret.VOLLEY_RANGE = float('inf')
+
+    def teardown(self):
+        Turret.CAN_SLEEP = self.can_sleep
+        Turret.CHECK_LOS = self.check_los
+        Turret.VOLLEY_RANGE = self.volley_range
+
+    def update(self, tick):
+        self.game.keys[SPACE] = (tick // 150) % 2 == 0
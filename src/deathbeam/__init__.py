@@ -1,3 +1,9 @@
+import pyglet
+
+# Don't let pyglet create its hidden shadow window when pyglet.window is
+# imported, so the simulation can be imported and run without a display.
+pyglet.options['shadow_window'] = False
+
 # These modules need to be imported, even though they aren't used, because
 # they register things that we need to load the world.
 from . import aliens, humans, tiles   # noqa
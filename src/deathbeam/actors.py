@@ -6,7 +6,50 @@ import pyglet
 from . import defs, helpers
 
 
+# Actors collide with everything in their mask, if the other actor's mask
+# has their layer in it too.
+COLLIDE_ALL = -1
+
 _actor_classes = []
+_collision_layers = {}
+_collision_types = {}
+
+
+def collision_layer(cell_type):
+    """Get the layer bit for actors of a cell type.
+
+    Each cell type gets its own bit the first time it's asked for.
+    """
+    layer = _collision_layers.get(cell_type)
+    if layer is None:
+        layer = 1 << len(_collision_layers)
+        _collision_layers[cell_type] = layer
+    return layer
+
+
+def collision_mask(collide_with):
+    """Turn a COLLIDE_WITH_ACTORS value into a mask of layers.
+
+    :param collide_with: True for every layer, False for none, or a list of
+        cell types.
+    """
+    if collide_with is True:
+        return COLLIDE_ALL
+    mask = 0
+    for cell_type in collide_with or ():
+        mask |= collision_layer(cell_type)
+    return mask
+
+
+def collision_types(mask):
+    """Get the cell types whose layers are all in a mask."""
+    cell_types = _collision_types.get(mask)
+    if cell_types is None:
+        cell_types = tuple(cell_type
+                           for cell_type, layer in _collision_layers.items()
+                           if mask & layer)
+        _collision_types[mask] = cell_types
+    return cell_types
 
 
 def iter_registered_actors():
@@ -22,8 +65,13 @@ def register_actor(cls):
 class Actor(object):
 
     ATTACHED_DISTANCE = 4
+    CAN_SLEEP = True  # skip updates while far from the action
     CELL_TYPE = None
-    COLLIDE_WITH_ACTORS = True
+    COLLIDE_WITH_ACTORS = True  # True, False or a list of cell types
+    # These are worked out for each subclass, from CELL_TYPE and
+    # COLLIDE_WITH_ACTORS, when it's defined.
+    COLLIDE_LAYER = 0
+    COLLIDE_MASK = COLLIDE_ALL
     COLLIDE_WITH_WORLD = True
     COLOR = (1, 1, 1, 1)
     DAMAGE = 0.0
@@ -38,18 +86,43 @@ class Actor(object):
     HEIGHT = 3
     Z = defs.Z_ACTOR_BACKGROUND
 
+    # Every subclass needs to declare __slots__ too, even if it's empty, or
+    # its instances will get a __dict__ anyway.
+    __slots__ = (
+        '_image', '_old_physics', 'anchor', 'cell', 'collide_mask', 'color',
+        'drag', 'game', 'gravity', 'height', 'old_x', 'old_y', 'on_ground',
+        'physics', 'prev_x', 'prev_y', 'vel_x', 'vel_y', 'width',
+        'x', 'y')
+
     def __init__(self, game, x=0.0, y=0.0, image=None):
         self.game = game
         self.x = x
         self.y = y
         self.old_x = x
         self.old_y = y
+        self.prev_x = x
+        self.prev_y = y
         self.vel_x = 0.0
         self.vel_y = 0.0
         self.anchor = None
         self.cell = None
         self.image = image
         self.on_ground = False
+        self._old_physics = None
+        # The constants that can change for each actor at runtime are copied
+        # to lowercase attributes, which physics and collisions use.
+        self.collide_mask = self.COLLIDE_MASK
+        self.color = self.COLOR
+        self.drag = self.DRAG
+        self.gravity = self.GRAVITY
+        self.physics = self.PHYSICS
+        self.width = self.WIDTH
+        self.height = self.HEIGHT
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.COLLIDE_LAYER = collision_layer(cls.CELL_TYPE)
+        cls.COLLIDE_MASK = collision_mask(cls.COLLIDE_WITH_ACTORS)
 
     def attach(self, actor):
         if self.anchor:
@@ -58,8 +131,9 @@ class Actor(object):
             self.detach()
         self.anchor = actor
         self.anchor.on_attached(self)
-        self._old_physics = self.PHYSICS
-        self.PHYSICS = defs.PHYSICS_ATTACHED
+        self.game.active_dirty = True
+        self._old_physics = self.physics
+        self.physics = defs.PHYSICS_ATTACHED
 
     def attach_text(self, text):
         from .particles import Text  # imported here for circular dependencies
@@ -73,56 +147,108 @@ class Actor(object):
             return
         self.anchor.on_detached(self)
         self.anchor = None
-        self.PHYSICS = self._old_physics
+        self.physics = self._old_physics
         self._old_physics = None
 
     def _collide_with_actors(self):
-        if isinstance(self.COLLIDE_WITH_ACTORS, list):
-            for cell_type in self.COLLIDE_WITH_ACTORS:
-                if cell_type not in self.game.actors_by_type:
+        if self.collide_mask == COLLIDE_ALL:
+            for actor in self.game.spatial_hash.query(
+                    self.x, self.y, self.width, self.height):
+                self._collide_with_actor(actor)
+        else:
+            actors_by_type = self.game.actors_by_type
+            for cell_type in collision_types(self.collide_mask):
+                if cell_type not in actors_by_type:
                     continue
-                for actor in self.game.actors_by_type[cell_type]:
+                for actor in actors_by_type[cell_type]:
                     self._collide_with_actor(actor)
-        else:
-            for actor in self.game.actors:
-                self._collide_with_actor(actor)
 
     def _collide_with_actor(self, actor):
-        if actor is self:
+        if not (self.collide_mask & actor.COLLIDE_LAYER and
+                actor.collide_mask & self.COLLIDE_LAYER):
             return
-        if not actor.COLLIDE_WITH_ACTORS:
-            return
-        if (self.x > actor.x + actor.WIDTH or
-                self.x + self.WIDTH < actor.x):
+        if actor is self:
             return
-        if (self.y > actor.y + actor.HEIGHT or
-                self.y + self.HEIGHT < actor.y):
+        if (self.x > actor.x + actor.width or
+                self.x + self.width < actor.x):
             return
-        if (isinstance(actor.COLLIDE_WITH_ACTORS, list) and
-                self.CELL_TYPE not in actor.COLLIDE_WITH_ACTORS):
+        if (self.y > actor.y + actor.height or
+                self.y + self.height < actor.y):
             return
         self.on_collide(actor, True)
         actor.on_collide(self, True)
 
     def _collide_with_world(self):
-        self.x, self.y, hit_1, hit_ground_1, cell = self.game.world.map.trace(
-            self.old_x, self.old_y, self.x, self.y)
-        self.x, self.y, hit_2, hit_ground_2, cell = self.game.world.map.trace(
-            self.old_x, self.old_y, self.x, self.y)
-        if not self.on_ground and (hit_ground_1 or hit_ground_2):
-            self.on_ground = True
-        cell = self.game.world.map.get_for_xy(self.x, self.y)
-        if self.cell is not cell:
+        map = self.game.world.map
+        x = self.old_x
+        y = self.old_y
+        dx = self.x - x
+        dy = self.y - y
+        hit = False
+        # Stop at the first edge the box hits, then slide along it for the
+        # rest of the move. That can only happen once for each axis.
+        for i in range(2):
+            t, normal_x, normal_y, cell = map.sweep(
+                x, y, self.width, self.height, dx, dy)
+            if cell is None:
+                x += dx
+                y += dy
+                break
+            hit = True
+            if normal_x:
+                if normal_x < 0:
+                    x = cell.x - self.width
+                else:
+                    x = cell.x + cell.width
+                y += dy * t
+                dx = 0
+                dy *= 1.0 - t
+            else:
+                if normal_y > 0:
+                    y = cell.y + cell.height
+                    self.on_ground = True
+                else:
+                    y = cell.y - self.height
+                x += dx * t
+                dx *= 1.0 - t
+                dy = 0
+        cell = map.get_for_xy(x, y)
+        if cell and cell.bounds & defs.CELL_EDGE_SLOPE:
+            y, hit_slope = cell.clip_slope(x, y)
+            if hit_slope:
+                hit = True
+                self.on_ground = True
+                cell = map.get_for_xy(x, y)
+        self.x = x
+        self.y = y
+        # Streamed maps can make a new MapCell for the same cell, so this
+        # checks which cell it is, not just which object.
+        old_cell = self.cell
+        if cell is not old_cell and (cell is None or old_cell is None or
+                                     cell.index != old_cell.index):
             self.cell = cell
             if cell and cell.type:
                 self.on_cell(cell)
-        if (hit_1 or hit_2) and self.REMOVE_ON_COLLIDE:
+        if hit and self.REMOVE_ON_COLLIDE:
             self.game.remove(self)
 
     def draw(self):
         x = self.x
         y = self.y
-        self.game.draw.quad(x, y, self.WIDTH, self.HEIGHT, self.Z, self.COLOR)
+        self.game.draw.quad(x, y, self.width, self.height, self.Z, self.color)
+
+    def draw_interpolated(self, alpha):
+        """Draw the actor between its previous and current position.
+
+        :param float alpha: How far to go from the previous position (0.0)
+            to the current one (1.0).
+        """
+        x = self.x
+        y = self.y
+        self.x, self.y = self.interpolate(alpha)
+        self.draw()
+        self.x = x
+        self.y = y
 
     @property
     def image(self):
@@ -131,8 +257,10 @@ class Actor(object):
     @image.setter
     def image(self, new_image):
         if isinstance(new_image, str):
-            new_image = pyglet.image.load(new_image)
-            helpers.set_nearest(new_image)
+            if self.game.atlas:
+                new_image = self.game.atlas.load(new_image)
+            else:
+                new_image = pyglet.image.load(new_image)
         self._image = new_image
         if self._image:
             helpers.set_anchor(self._image, 0.5, 0.0)
@@ -142,6 +270,10 @@ class Actor(object):
     def image(self):
         del self._image
 
+    def interpolate(self, alpha):
+        return (self.prev_x + (self.x - self.prev_x) * alpha,
+                self.prev_y + (self.y - self.prev_y) * alpha)
+
     def on_attached(self, actor):
         pass
 
@@ -173,33 +305,34 @@ class Actor(object):
         if self.vel_y > 0:
             self.on_ground = False
         # physics
-        if self.PHYSICS == defs.PHYSICS_VELOCITY:
+        if self.physics == defs.PHYSICS_VELOCITY:
             self._update_velocity(dt)
-        elif self.PHYSICS == defs.PHYSICS_ATTACHED:
+        elif self.physics == defs.PHYSICS_ATTACHED:
             self._update_attached(dt)
         # collision
         if self.x != self.old_x or self.y != self.old_y:
             if self.COLLIDE_WITH_WORLD:
                 self._collide_with_world()
-            if self.COLLIDE_WITH_ACTORS:
+            if self.collide_mask:
                 self._collide_with_actors()
         # attachment physics need correction after collision
-        if self.PHYSICS == defs.PHYSICS_ATTACHED:
+        if self.physics == defs.PHYSICS_ATTACHED:
             self._update_attached_distance(dt)
         self.old_x = self.x
         self.old_y = self.y
 
     def _update_attached(self, dt):
         if self.anchor:
-            self.y -= self.GRAVITY * 0.5
+            self.y -= self.gravity * 0.5
 
     def _update_attached_distance(self, dt):
         if not self.anchor:
             return
         dx = self.anchor.x - self.x
         dy = self.anchor.y - self.y
-        length = math.sqrt(dx*dx + dy*dy)
-        if length > self.ATTACHED_DISTANCE:
+        length_squared = dx*dx + dy*dy
+        if length_squared > self.ATTACHED_DISTANCE * self.ATTACHED_DISTANCE:
+            length = math.sqrt(length_squared)
             dx /= length
             dy /= length
             self.x += dx * (length - self.ATTACHED_DISTANCE)
@@ -208,9 +341,9 @@ class Actor(object):
     def _update_velocity(self, dt):
         self.x += self.vel_x * dt
         self.y += self.vel_y * dt
-        self.y -= self.GRAVITY
-        self.vel_x *= self.DRAG
-        self.vel_y *= self.DRAG
+        self.y -= self.gravity
+        self.vel_x *= self.drag
+        self.vel_y *= self.drag
         if abs(self.vel_x) < 0.001:
             self.vel_x = 0
         if abs(self.vel_y) < 0.001:
@@ -19,6 +19,7 @@ class Mothership(Actor):
     BEAM_ROTATE_TIME = 0.1
     BEAM_WIDTH = 2
     BEAM_Z = defs.Z_BEAM
+    CAN_SLEEP = False
     CELL_TYPE = defs.CELL_ALIEN_MOTHERSHIP
     COLLIDE_WITH_ACTORS = False
     COLLIDE_WITH_WORLD = False
@@ -27,6 +28,8 @@ class Mothership(Actor):
     HEIGHT = 16
     Z = defs.Z_ACTOR_FOREGROUND
 
+    __slots__ = ('beam_rotate', 'beam_rotate_time', 'beam_sounds')
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.beam_rotate = 0
@@ -38,8 +41,8 @@ class Mothership(Actor):
 
     def draw(self):
         # ship
-        self.game.draw.quad(self.x - self.WIDTH / 2, self.y, self.WIDTH,
-                            self.HEIGHT, self.Z, (0, 0, 0, 1))
+        self.game.draw.quad(self.x - self.width / 2, self.y, self.width,
+                            self.height, self.Z, (0, 0, 0, 1))
 
         # beam
         while self.game.time >= self.beam_rotate_time:
@@ -64,6 +67,7 @@ class Mothership(Actor):
 class Turret(Actor):
 
     CELL_TYPE = defs.CELL_ALIEN_TURRET
+    CHECK_LOS = True  # don't shoot at the player through the map
     COLOR = (0.4, 0.4, 0.4, 1)
     VOLLEY_DELAY = 2.0
     VOLLEY_RANGE = 256
@@ -73,6 +77,8 @@ class Turret(Actor):
     WIDTH = 10
     HEIGHT = 10
 
+    __slots__ = ('fire_sound', 'volley_rounds', 'volley_time')
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fire_sound = Sound(self, 'turret_fire.wav')
@@ -98,10 +104,16 @@ class Turret(Actor):
             return
         self.volley_time = self.game.time + self.VOLLEY_ROUNDS_DELAY
         self.volley_rounds += 1
-        dx = self.game.player.x - self.x
-        dy = self.game.player.y - self.y
+        player = self.game.player
+        dx = player.x - self.x
+        dy = player.y - self.y
         length = math.sqrt(dx*dx + dy*dy)
         if length and length <= self.VOLLEY_RANGE:
+            if self.CHECK_LOS and self.game.world.map.raycast(
+                    self.x + self.width / 2, self.y + self.height / 2,
+                    player.x + player.width / 2,
+                    player.y + player.height / 2):
+                return  # the player is behind something solid
             dx /= length
             dy /= length
             self.fire(dx, dy, self.game.time)
@@ -0,0 +1,80 @@
+"""Pack tiles and sprites into shared textures.
+
+Every image added to a TextureAtlas is copied into one of its pages, with
+a border of padding around it. The border is filled by repeating the
+image's edge pixels, so when a scaled up quad samples a little outside
+its own texture coordinates under GL_NEAREST, it gets the same colour and
+not a pixel from the image next to it.
+
+Most things fit on the first page, so tiles and sprites can all be drawn
+with the same texture bound.
+"""
+from __future__ import absolute_import
+
+import numpy
+import pyglet
+from pyglet import gl
+from pyglet.image.atlas import Allocator, AllocatorException
+
+
+class TextureAtlas(object):
+
+    """TextureAtlas packs images into pages of a fixed size.
+
+    This must be created while the window's GL context is current.
+    """
+
+    def __init__(self, size=1024, padding=1):
+        self.size = size
+        self.padding = padding
+        self.pages = []
+        self.images = {}
+        self._add_page()
+
+    def _add_page(self):
+        texture = pyglet.image.Texture.create(
+            self.size, self.size, gl.GL_RGBA,
+            min_filter=gl.GL_NEAREST, mag_filter=gl.GL_NEAREST)
+        self.pages.append((texture, Allocator(self.size, self.size)))
+
+    def _pad(self, image):
+        p = self.padding
+        image = image.get_image_data()
+        pixels = numpy.frombuffer(
+            image.get_data('RGBA', image.width * 4), dtype=numpy.uint8)
+        pixels = pixels.reshape((image.height, image.width, 4))
+        pixels = numpy.pad(pixels, ((p, p), (p, p), (0, 0)), mode='edge')
+        return pyglet.image.ImageData(image.width + p * 2,
+                                      image.height + p * 2, 'RGBA',
+                                      pixels.tobytes())
+
+    def add(self, image):
+        """Copy an image into the atlas.
+
+        :param image: Any pyglet image that can give back its image data,
+            such as the regions of an ImageGrid.
+        :returns: TextureRegion of one of the pages.
+        """
+        padded = self._pad(image)
+        texture, allocator = self.pages[-1]
+        try:
+            x, y = allocator.alloc(padded.width, padded.height)
+        except AllocatorException:
+            self._add_page()
+            texture, allocator = self.pages[-1]
+            x, y = allocator.alloc(padded.width, padded.height)
+        texture.blit_into(padded, x, y, 0)
+        return texture.get_region(x + self.padding, y + self.padding,
+                                  image.width, image.height)
+
+    def load(self, filename):
+        """Load an image file into the atlas.
+
+        Each file is only added once, and the same region is returned every
+        time it's loaded.
+        """
+        region = self.images.get(filename)
+        if region is None:
+            region = self.images[filename] = self.add(
+                pyglet.image.load(filename))
+        return region
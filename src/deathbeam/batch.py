@@ -0,0 +1,111 @@
+"""Run lots of headless games in parallel, for soak and balance testing.
+
+The parent loads the world before forking the worker processes, so the map
+grids and tileset images are shared copy-on-write rather than read again by
+every worker. Each worker makes the map's cells as its games need them, and
+keeps them for every game after that. Streamed maps can't share their file
+or loading thread, so each worker opens the map file again. Where fork
+isn't available, every worker loads the world for itself.
+
+Headless games never touch the process-global window state (``Game.window``
+and ``Game.current``), so a worker can run any number of them one after
+another.
+"""
+from __future__ import absolute_import
+import logging
+import multiprocessing
+import os
+import time
+
+from .game import Game
+
+
+logger = logging.getLogger('deathbeam')
+
+
+def aggregate(results):
+    """Combine the results from :func:`run_batch` into a summary.
+
+    :param list results: Results for each game.
+    :returns: dict
+    """
+    ticks = sum(r['ticks'] for r in results)
+    seconds = sum(r['seconds'] for r in results)
+    points = [r['points'] for r in results]
+    return {
+        'runs': len(results),
+        'ticks': ticks,
+        'seconds': seconds,
+        'ticks_per_second': ticks / seconds if seconds else 0.0,
+        'points_min': min(points) if points else 0,
+        'points_max': max(points) if points else 0,
+        'points_mean': sum(points) / len(points) if points else 0.0,
+        'humans_saved': sum(r['humans_saved'] for r in results),
+        'humans_lost': sum(r['humans_lost'] for r in results),
+        'wins': sum(1 for r in results if r['game_over'] and
+                    not r['game_lost']),
+        'losses': sum(1 for r in results if r['game_lost']),
+    }
+
+
+def run_batch(seeds, ticks, update=None, processes=None):
+    """Run a headless game for each seed across a pool of processes.
+
+    :param list seeds: Random seed for each game.
+    :param int ticks: Maximum number of ticks to run each game for.
+    :param func update: Optional function called as ``update(game, tick)``
+        before every tick, to drive the player. It must be picklable, so it
+        has to be defined at the top level of a module.
+    :param int processes: Number of worker processes. Defaults to the number
+        of CPUs.
+    :returns: (results, summary), where results is a list with a dict for
+        each game in the same order as seeds, and summary is the output of
+        :func:`aggregate`.
+    """
+    seeds = list(seeds)
+    processes = processes or os.cpu_count() or 1
+    start = time.perf_counter()
+    try:
+        context = multiprocessing.get_context('fork')
+    except ValueError:
+        # Not available on Windows, so the workers have to import everything
+        # for themselves.
+        context = multiprocessing.get_context()
+    else:
+        # The world stays loaded after the game is closed, so the workers
+        # start with it.
+        Game(headless=True, seed=0).close()
+    args = [(seed, ticks, update) for seed in seeds]
+    chunksize = max(1, len(args) // (processes * 4))
+    with context.Pool(processes) as pool:
+        results = pool.map(_run_game, args, chunksize)
+    logger.info('ran %d games on %d processes in %.3fs', len(results),
+                processes, time.perf_counter() - start)
+    return results, aggregate(results)
+
+
+def _run_game(args):
+    seed, ticks, update = args
+    game = Game(headless=True, seed=seed)
+    start = time.perf_counter()
+    if update:
+        for tick in range(ticks):
+            if game.game_over:
+                break
+            update(game, tick)
+            game.tick()
+    else:
+        game.run(ticks)
+    seconds = time.perf_counter() - start
+    game.close()
+    score = game.score
+    return {
+        'seed': seed,
+        'ticks': game.ticks,
+        'seconds': seconds,
+        'points': score.get(score.POINTS),
+        'humans_saved': score.get(score.HUMANS_SAVED),
+        'humans_lost': score.get(score.HUMANS_LOST),
+        'game_over': game.game_over,
+        'game_lost': game.game_lost,
+    }
@@ -3,8 +3,20 @@ import os
 import sys
 
 
+# Actors further than this from both the camera target and the mothership
+# go to sleep, and aren't updated. Actors on screen, or up to ACTIVE_MARGIN
+# off it, are always awake, however big the camera is.
+ACTIVE_MARGIN = 128
+ACTIVE_RANGE = 512
+ACTIVE_REBUILD_TICKS = 8  # how often to check which actors are asleep
+
 ASSETS_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'assets')
 
+BATCH_RUNS = 0
+if '--batch' in sys.argv:
+    i = sys.argv.index('--batch')
+    BATCH_RUNS = int(sys.argv[i+1])
+
 CELL_HUMAN_PLAYER = 1        # 1-49 human actors
 CELL_HUMAN_CIVILIAN = 2
 CELL_HUMAN_SCIENTIST = 3
@@ -26,10 +38,60 @@ CELL_EDGE_SLOPE = 128
 FONT = 'Atari Classic Chunky'
 FONT_FILE = os.path.join(ASSETS_DIR, 'atarcc__.ttf')
 
+HEADLESS = False
+if '--headless' in sys.argv:
+    HEADLESS = True
+HEADLESS_TICKS = 6000
+if '--ticks' in sys.argv:
+    i = sys.argv.index('--ticks')
+    HEADLESS_TICKS = int(sys.argv[i+1])
+
+MAP_CHUNK_SIZE = 16  # cells on each side of a baked map chunk
+MAP_STREAM_CACHE = 256  # most chunks of a streamed map kept in memory
+
+PARTICLE_BUDGET = 4096  # most particles alive at once
+if '--particle-budget' in sys.argv:
+    i = sys.argv.index('--particle-budget')
+    PARTICLE_BUDGET = int(sys.argv[i+1])
+PARTICLE_CULL_MARGIN = 128  # how far off screen batched particles can spawn
+
+PERF_HUD = False
+if '--perf-hud' in sys.argv:
+    PERF_HUD = True
+
 PHYSICS_NONE = 0      # don't apply any physics
 PHYSICS_ATTACHED = 1  # like velocity, but anchored to another actor
 PHYSICS_VELOCITY = 2  # apply normal velocity physics
 
+RECORD_FILE = None
+if '--record' in sys.argv:
+    i = sys.argv.index('--record')
+    RECORD_FILE = sys.argv[i+1]
+
+RENDER_RATE = 60
+if '--fps' in sys.argv:
+    i = sys.argv.index('--fps')
+    RENDER_RATE = float(sys.argv[i+1])
+
+REPLAY_FILE = None
+if '--replay' in sys.argv:
+    i = sys.argv.index('--replay')
+    REPLAY_FILE = sys.argv[i+1]
+
+SEED = None
+if '--seed' in sys.argv:
+    i = sys.argv.index('--seed')
+    SEED = int(sys.argv[i+1])
+
+SIM_MAX_STEPS = 5
+if '--max-substeps' in sys.argv:
+    i = sys.argv.index('--max-substeps')
+    SIM_MAX_STEPS = int(sys.argv[i+1])
+SIM_STEP = 0.015
+if '--sim-rate' in sys.argv:
+    i = sys.argv.index('--sim-rate')
+    SIM_STEP = 1.0 / float(sys.argv[i+1])
+
 SOUND = True
 if '--no-sound' in sys.argv:
     SOUND = False
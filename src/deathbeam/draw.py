@@ -1,9 +1,11 @@
 from __future__ import absolute_import
+import time
 
 import pyglet
 from pyglet import gl
 
 from . import defs
+from .particle_renderer import ParticleRenderer
 
 
 class Draw(object):
@@ -12,6 +14,8 @@ class Draw(object):
         self.game = game
         self.callbacks = {}
         self.labels = []
+        self.particle_renderer = None
+        self.particle_instances = {}
         self.quads = {}
 
     def create_label(self, size=12, x=0.0, y=0.0, text='', **kwargs):
@@ -19,11 +23,15 @@ class Draw(object):
                                  x=x, y=y)
 
     def flush(self):
+        # Most of the work of drawing the map and particles happens here,
+        # rather than when they're queued, so it's timed here.
+        spent = {'draw_map': 0.0, 'draw_particles': 0.0}
         gl.glPushMatrix()
-        gl.glScalef(defs.WINDOW_SCALE[0], defs.WINDOW_SCALE[1], 1)
+        gl.glScalef(self.game.scale[0], self.game.scale[1], 1)
         gl.glTranslatef(-self.game.camera_x, -self.game.camera_y, 0)
         # draw quads
         keys = list(set(list(self.callbacks.keys()) +
+                        list(self.particle_instances.keys()) +
                         list(self.quads.keys())))
         keys.sort()
         for k in keys:
@@ -55,51 +63,124 @@ class Draw(object):
                                        gl.GL_ONE_MINUS_SRC_ALPHA)
                         gl.glBegin(gl.GL_QUADS)
             gl.glEnd()
+            instances = self.particle_instances.get(k)
+            if instances:
+                t = time.perf_counter()
+                if self.particle_renderer is None:
+                    self.particle_renderer = ParticleRenderer()
+                self.particle_renderer.draw(k, instances)
+                spent['draw_particles'] += time.perf_counter() - t
             callbacks = self.callbacks.get(k)
             if callbacks:
-                for callback, args, kwargs in callbacks:
+                for callback, args, kwargs, phase in callbacks:
+                    if phase is None:
+                        callback(*args, **kwargs)
+                        continue
+                    t = time.perf_counter()
                     callback(*args, **kwargs)
+                    spent[phase] += time.perf_counter() - t
         gl.glPopMatrix()
+        for phase, seconds in spent.items():
+            self.game.perf.add(phase, seconds)
         self.callbacks = {}
+        self.particle_instances = {}
         self.quads = {}
         self.flush_labels()
 
     def flush_labels(self):
         gl.glClear(gl.GL_DEPTH_BUFFER_BIT)
         gl.glPushMatrix()
-        gl.glTranslatef(-self.game.camera_x * defs.WINDOW_SCALE[0],
-                        -self.game.camera_y * defs.WINDOW_SCALE[1], 0)
+        gl.glTranslatef(-self.game.camera_x * self.game.scale[0],
+                        -self.game.camera_y * self.game.scale[1], 0)
         for label, x, y, scale in self.labels:
             if scale:
                 gl.glPushMatrix()
                 label.anchor_x = 'center'
                 label.anchor_y = 'center'
-                gl.glTranslatef(x * defs.WINDOW_SCALE[0],
-                                y * defs.WINDOW_SCALE[1], 0)
+                gl.glTranslatef(x * self.game.scale[0],
+                                y * self.game.scale[1], 0)
                 gl.glScalef(*scale)
                 label.x = label.y = 0
                 label.draw()
                 gl.glPopMatrix()
             else:
-                label.x = x * defs.WINDOW_SCALE[0]
-                label.y = y * defs.WINDOW_SCALE[1]
+                label.x = x * self.game.scale[0]
+                label.y = y * self.game.scale[1]
                 label.draw()
         self.labels = []
         gl.glColor3f(1, 1, 1)
         gl.glEnable(gl.GL_DEPTH_TEST)
         gl.glPopMatrix()
-        # self.fps_label.draw()
-        self.game.score.draw()
 
     def callback(self, callback, *args, **kwargs):
+        """Queue a function to be called when its layer is drawn.
+
+        The arguments are passed on to it, and must include ``z``, the layer
+        to draw on. ``phase`` isn't passed on. It can be ``'draw_map'`` or
+        ``'draw_particles'``, to count the time the call takes towards that
+        PerfHud phase.
+        """
+        phase = kwargs.pop('phase', None)
         if kwargs['z'] not in self.callbacks:
             self.callbacks[kwargs['z']] = []
-        self.callbacks[kwargs['z']].append((callback, args, kwargs))
+        self.callbacks[kwargs['z']].append((callback, args, kwargs, phase))
 
     def label(self, label, x, y, scale=None):
         self.labels.append((label, x, y, scale))
 
+    def particles(self, z, instances):
+        """Queue particles to be drawn with the particle renderer.
+
+        Every array queued for the same layer is drawn in a single call.
+
+        :param float z: Layer to draw the particles on.
+        :param instances: float32 array of particle instances, laid out as
+            described in particle_renderer.
+        """
+        if z not in self.particle_instances:
+            self.particle_instances[z] = []
+        self.particle_instances[z].append(instances)
+
     def quad(self, x, y, w, h, z, c1=None, c2=None, c3=None, c4=None, bf=None):
         if z not in self.quads:
             self.quads[z] = []
         self.quads[z].append((x, y, w, h, z, c1, c2, c3, c4, bf))
+
+
+class NullDraw(Draw):
+
+    """NullDraw is used by headless games, and throws away anything drawn."""
+
+    def create_label(self, size=12, x=0.0, y=0.0, text='', **kwargs):
+        return NullLabel(text=text, x=x, y=y)
+
+    def flush(self):
+        pass
+
+    def flush_labels(self):
+        pass
+
+    def callback(self, callback, *args, **kwargs):
+        pass
+
+    def label(self, label, x, y, scale=None):
+        pass
+
+    def particles(self, z, instances):
+        pass
+
+    def quad(self, x, y, w, h, z, c1=None, c2=None, c3=None, c4=None, bf=None):
+        pass
+
+
+class NullLabel(object):
+
+    """NullLabel stands in for a pyglet label when there is no GL context."""
+
+    def __init__(self, text='', x=0.0, y=0.0):
+        self.text = text
+        self.x = x
+        self.y = y
+
+    def draw(self):
+        pass
@@ -1,5 +1,4 @@
 from __future__ import absolute_import
-import random
 
 from pyglet.gl import GL_SRC_ALPHA, GL_DST_COLOR
 
@@ -56,9 +55,9 @@ class Mothership(Effect):
         cls.f = 1.0 - (cls.x / cls.DISTANCE)
         cls.f *= cls.f
         game.camera_x += (
-            random.uniform(-cls.SHAKE, cls.SHAKE) * cls.f)
+            game.random.effects.uniform(-cls.SHAKE, cls.SHAKE) * cls.f)
         game.camera_y += (
-            random.uniform(-cls.SHAKE, cls.SHAKE) * cls.f)
+            game.random.effects.uniform(-cls.SHAKE, cls.SHAKE) * cls.f)
 
     @classmethod
     def post_draw(cls, game):
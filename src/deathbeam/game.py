@@ -1,79 +1,203 @@
 from __future__ import absolute_import
 import logging
+import random
 import time
 
 import pyglet
 from pyglet import gl
-from pyglet.window.key import C, ENTER, SPACE
+from pyglet.window.key import C, ENTER, F3
 
-from . import defs, helpers, worlds
+from . import defs, worlds
 from .actors import iter_registered_actors
-from .draw import Draw
+from .atlas import TextureAtlas
+from .draw import Draw, NullDraw
 from .effects import iter_registered_effects
-from .particles import Arrow, Particle
+from .particle_engine import ParticleEngine
+from .particles import Arrow, Particle, ParticlePool
+from .perf import PerfHud
+from .replay import Recorder, Replay
+from .rng import RandomStreams
 from .score import Score
+from .slotmap import SlotMap
 from .sounds import AmbientSound
+from .spatial import SpatialHash
 
 
 logger = logging.getLogger('deathbeam')
 
 
+class EventLoop(pyglet.app.EventLoop):
+
+    """EventLoop runs scheduled functions without redrawing the windows.
+
+    pyglet's own loop draws and flips every window whenever any scheduled
+    function has run, which would draw a frame after every update. The game
+    draws its frames from Game.on_render instead, at RENDER_RATE.
+    """
+
+    def idle(self):
+        self.clock.call_scheduled_functions(self.clock.update_time())
+        return self.clock.get_sleep_time(True)
+
+
 class Game(object):
 
+    current = None  # the game that the window belongs to
     window = None
 
-    def __init__(self):
+    def __init__(self, headless=False, seed=None, record=None, replay=None):
+        self.headless = headless
+        # There's nobody around to hear a headless game.
+        self.sound = defs.SOUND and not headless
+        if self.headless:
+            self.keyboard = pyglet.window.key.KeyStateHandler()
+            self.scale = tuple(defs.WINDOW_SCALE)
+
         # window
-        if not self.window:
-            pyglet.font.add_file(defs.FONT_FILE)
-            self.keys = pyglet.window.key.KeyStateHandler()
-            if defs.WINDOW_FULLSCREEN:
-                self.window = pyglet.window.Window(
-                    fullscreen=defs.WINDOW_FULLSCREEN,
-                    vsync=defs.WINDOW_VSYNC)
-                defs.WINDOW_SCALE[0] *= self.window.width / defs.WINDOW_WIDTH
-                defs.WINDOW_SCALE[1] *= self.window.height / defs.WINDOW_HEIGHT
-            else:
-                self.window = pyglet.window.Window(vsync=defs.WINDOW_VSYNC,
-                                                   width=defs.WINDOW_WIDTH,
-                                                   height=defs.WINDOW_HEIGHT)
+        if not self.headless:
+            # There's only ever one window, which is handed over to the
+            # newest game, along with its updates.
+            if Game.window is None:
+                pyglet.font.add_file(defs.FONT_FILE)
+                if defs.WINDOW_FULLSCREEN:
+                    Game.window = pyglet.window.Window(
+                        fullscreen=defs.WINDOW_FULLSCREEN,
+                        vsync=defs.WINDOW_VSYNC)
+                else:
+                    Game.window = pyglet.window.Window(
+                        vsync=defs.WINDOW_VSYNC, width=defs.WINDOW_WIDTH,
+                        height=defs.WINDOW_HEIGHT)
+                pyglet.app.event_loop = EventLoop()
+            elif Game.current:
+                Game.current.detach()
+            Game.current = self
+            # Fullscreen windows are scaled up to fill the screen.
+            self.scale = (
+                defs.WINDOW_SCALE[0] * self.window.width / defs.WINDOW_WIDTH,
+                defs.WINDOW_SCALE[1] * self.window.height /
+                defs.WINDOW_HEIGHT)
+            self.keyboard = pyglet.window.key.KeyStateHandler()
             self.window.push_handlers(self.on_close)
             self.window.push_handlers(self.on_draw)
             self.window.push_handlers(self.on_key_press)
-            self.window.push_handlers(self.on_key_release)
-            self.window.push_handlers(self.keys)
-            pyglet.clock.schedule(self.on_update, 1.0 / 60)
+            self.window.push_handlers(self.keyboard)
+            pyglet.clock.schedule_interval(self.on_update, defs.SIM_STEP)
+            pyglet.clock.schedule_interval(self.on_render,
+                                           1.0 / defs.RENDER_RATE)
 
         # gl
-        gl.glClearColor(0.6, 0.5, 0.7, 1)
-        gl.glEnable(gl.GL_DEPTH_TEST)
-        gl.glEnable(gl.GL_BLEND)
-        gl.glBlendFunc(gl.GL_SRC_ALPHA, gl.GL_ONE_MINUS_SRC_ALPHA)
+        self.atlas = None
+        if not self.headless:
+            gl.glClearColor(0.6, 0.5, 0.7, 1)
+            gl.glEnable(gl.GL_DEPTH_TEST)
+            gl.glEnable(gl.GL_BLEND)
+            gl.glBlendFunc(gl.GL_SRC_ALPHA, gl.GL_ONE_MINUS_SRC_ALPHA)
+            self.atlas = TextureAtlas()
+
+        # input
+        self.step = defs.SIM_STEP
+        self.keys = self.keyboard
+        self.recorder = None
+        self.replay = None
+        if replay:
+            # Use the same seed and step as the recording, and ignore the
+            # keyboard while it plays back.
+            self.replay = Replay(replay, on_restart=self.restart)
+            self.keys = self.replay.keys
+            self.step = self.replay.step
+            seed = self.replay.seed
+        if seed is None:
+            seed = random.SystemRandom().getrandbits(32)
+        logging.info('using random seed %d', seed)
+        self.seed = seed
+
+        # camera
+        if self.headless:
+            self.camera_width = defs.WINDOW_WIDTH / self.scale[0]
+            self.camera_height = defs.WINDOW_HEIGHT / self.scale[1]
+        else:
+            self.camera_width = self.window.width / self.scale[0]
+            self.camera_height = self.window.height / self.scale[1]
+        if self.replay and self.replay.camera_size:
+            # The camera size decides which actors are awake, so play back
+            # with the recorded one, stretched to fit the window.
+            self.camera_width, self.camera_height = self.replay.camera_size
+            if not self.headless:
+                self.scale = (self.window.width / self.camera_width,
+                              self.window.height / self.camera_height)
+        if record:
+            self.recorder = Recorder(
+                record, self.seed, self.step,
+                (self.camera_width, self.camera_height))
 
         # game
-        self.draw = Draw(self)
+        if self.headless:
+            self.draw = NullDraw(self)
+        else:
+            self.draw = Draw(self)
         self.score = Score(self)
-
-        AmbientSound.stop_all()
-        self.actors = []
-        self.actors_by_type = {}
-        self.camera_x = 0
-        self.camera_y = 0
-        self.camera_target = None
-        self.camera_width = self.window.width / defs.WINDOW_SCALE[0]
-        self.camera_height = self.window.height / defs.WINDOW_SCALE[1]
-        self.dt = 0
-        self.fps_label = pyglet.clock.ClockDisplay()
+        self.perf = PerfHud(self)
         self.effects = []
-        self.game_lost = False
-        self.game_over = False
         self.loaded = False
-        self.mothership = None
-        self.particles = []
-        self.player = None
-        self.time = 0
+        self.particle_engine = ParticleEngine(self)
+        self.particle_pools = {}
+        self.snapshot = None
+        self.reset()
         self.load()
 
+    def close(self):
+        """Save the recording, and close anything the world has open.
+
+        The world is loaded again by the next game.
+        """
+        if self.recorder:
+            self.recorder.save()
+        self.world.close()
+
+    def detach(self):
+        """Stop handling the window's events and updates."""
+        self.window.remove_handlers(self.keyboard)
+        self.window.remove_handlers(self.on_key_press)
+        self.window.remove_handlers(self.on_draw)
+        self.window.remove_handlers(self.on_close)
+        pyglet.clock.unschedule(self.on_update)
+        pyglet.clock.unschedule(self.on_render)
+        if Game.current is self:
+            Game.current = None
+
+    def flush_queues(self):
+        """Add and remove the actors queued by spawn() and remove()."""
+        while self.spawn_queue or self.remove_queue:
+            spawned, self.spawn_queue = self.spawn_queue, []
+            for actor in spawned:
+                if isinstance(actor, Particle):
+                    self.particles.add(actor)
+                    continue
+                self.actors.add(actor)
+                self.active_dirty = True
+                self.spatial_hash.add(actor)
+                if actor.CELL_TYPE not in self.actors_by_type:
+                    self.actors_by_type[actor.CELL_TYPE] = SlotMap()
+                self.actors_by_type[actor.CELL_TYPE].add(actor)
+            # Actors can be removed more than once in a tick, but on_remove
+            # should only be called the first time. It may spawn more actors,
+            # so keep going until the queues are empty.
+            removed, self.remove_queue = self.remove_queue, []
+            for actor in removed:
+                if isinstance(actor, Particle):
+                    if not self.particles.remove(actor):
+                        continue
+                    actor.on_remove()
+                    self.particle_pools[type(actor)].release(actor)
+                else:
+                    if not self.actors.remove(actor):
+                        continue
+                    self.actors_by_type[actor.CELL_TYPE].remove(actor)
+                    self.active_dirty = True
+                    self.spatial_hash.remove(actor)
+                    actor.on_remove()
+        self.particle_engine.flush()
+
     def get_world(self):
         return self.world
 
@@ -85,67 +209,57 @@ class Game(object):
         for cls in iter_registered_effects():
             self.effects.append(cls)
 
-        # Load the world, and spawn all the actors in it
+        # Load the world, and remember where all of its actors start, so that
+        # restarting can respawn them without loading everything again.
         self.world = worlds.load(self, 'tiles')
         self.world.load_map('test_map_horiz')
+        self.snapshot = []
         for cls in iter_registered_actors():
             cell_type = cls.CELL_TYPE
             if not cell_type:
                 continue
             for cell in self.world.map.get_for_type(cell_type):
-                self.spawn(cls, x=cell.x, y=cell.y)
-
-        self.player = self.actors_by_type[defs.CELL_HUMAN_PLAYER][0]
-        self.mothership = self.actors_by_type[defs.CELL_ALIEN_MOTHERSHIP][0]
-
-        # Create an arrow pointing to the right, above the player's start point
-        self.spawn(Arrow, self.player.x, self.player.y + 100)
-
-        # Create an arrow pointing toward the rocket, at the end
-        rocket = self.actors_by_type[defs.CELL_HUMAN_ROCKET][0]
-        self.spawn(Arrow, rocket.x - 35, rocket.y - 15)
+                self.snapshot.append((cls, cell.x, cell.y))
+        self.spawn_snapshot()
 
         self.loaded = True
 
     def on_close(self):
         logging.info('shutdown at %s', self.time)
+        self.close()
 
     def on_draw(self):
+        self.perf.frame()
         self.window.clear()
 
-        if self.camera_target is None:
-            self.camera_target = self.player
-        self.camera_x = self.camera_target.x - self.camera_width / 2
-        self.camera_y = self.camera_target.y - self.camera_height / 2
-        if self.camera_x < 0:
-            self.camera_x = 0
-        if self.camera_y < 0:
-            self.camera_y = 0
-        if self.camera_y > 800:
-            self.camera_y = 800
+        # Draw everything part of the way between the last two updates, based
+        # on how much time is left over in the accumulator.
+        alpha = self.dt / self.step
 
-        if not self.game_over:
-            if (self.player.has_rocket and
-                    self.player.y > 900 + self.camera_height):
-                self.game_over = True
-                self.game_lost = False
-            if self.player.y < 0 or self.player.x < self.mothership.x:
-                self.game_over = True
-                self.game_lost = True
-            self.on_game_over()
+        self.update_camera(alpha)
 
         if not self.game_over:
             for effect in self.effects:
                 effect.pre_draw(self)
+            t = time.perf_counter()
             self.world.map.draw()
+            t = self.perf.lap('queue_map', t)
             for actor in self.actors:
-                actor.draw()
+                actor.draw_interpolated(alpha)
+            t = self.perf.lap('queue_actors', t)
             for particle in self.particles:
-                particle.draw()
+                particle.draw_interpolated(alpha)
+            self.particle_engine.draw(alpha)
+            self.perf.lap('queue_particles', t)
             for effect in self.effects:
                 effect.post_draw(self)
 
+        t = time.perf_counter()
         self.draw.flush()
+        t = self.perf.lap('flush', t)
+        self.score.draw()
+        self.perf.lap('score', t)
+        self.perf.draw()
 
         self.window.invalid = False
 
@@ -156,34 +270,115 @@ class Game(object):
         if symbol == C:
             self.screenshot()
         elif symbol == ENTER:
-            self.__init__()
-
-    def on_key_release(self, symbol, modifiers):
-        if symbol == SPACE:
-            self.player.space_pressed = False
-
-    def on_update(self, dt, interval):
-        self.window.invalid = True
+            if self.replay:
+                # Watch the replay again from the start.
+                self.replay.rewind()
+            self.restart()
+        elif symbol == F3:
+            self.perf.toggle()
+
+    def on_render(self, dt):
+        # This is the only place that draws, as EventLoop doesn't, so that
+        # the frame rate is capped at RENDER_RATE no matter how often the
+        # loop spins.
+        self.window.switch_to()
+        self.window.dispatch_event('on_draw')
+        self.window.flip()
+
+    def on_update(self, dt):
         if self.game_over:
             return
-        self.time += dt
         self.dt += dt
-        while self.dt >= 0.015:
-            self.dt -= 0.015
-            for actor in self.actors:
-                actor.update(0.015)
-            for particle in self.particles:
-                particle.update(0.015)
-        AmbientSound.update_all()
+        steps = 0
+        while self.dt >= self.step and not self.game_over:
+            if steps >= defs.SIM_MAX_STEPS:
+                # We've fallen too far behind to catch up. Running even more
+                # updates would only make the next frame later still, so drop
+                # the whole steps and keep the remainder for interpolation.
+                dropped = int(self.dt / self.step)
+                self.dropped_ticks += dropped
+                self.dt -= dropped * self.step
+                break
+            self.dt -= self.step
+            self.tick()
+            steps += 1
+        if self.sound:
+            AmbientSound.update_all()
+
+    def particle_stats(self):
+        """Get the pool and batch sizes for each class of particle.
+
+        :returns: dict mapping class names to dicts of ``live``, ``spare``
+            (pooled objects or unused batch capacity) and ``high_water``.
+        """
+        stats = {}
+        for cls, pool in self.particle_pools.items():
+            stats[cls.__name__] = {'live': pool.in_use, 'spare': len(pool),
+                                   'high_water': pool.high_water}
+        for cls, batch in self.particle_engine.batches.items():
+            stats[cls.__name__] = {
+                'live': batch.count,
+                'spare': batch.data.shape[1] - batch.count,
+                'high_water': batch.high_water}
+        return stats
 
     def remove(self, actor):
-        actor.on_remove()
-        if isinstance(actor, Particle):
-            helpers.remove(self.particles, actor)
-        else:
-            helpers.remove(self.actors, actor)
-            helpers.remove(self.actors_by_type[actor.CELL_TYPE], actor)
-        del actor
+        """Queue an actor to be removed at the end of the tick."""
+        self.remove_queue.append(actor)
+
+    def reset(self):
+        """Reset all of the state for a game, and remove every actor."""
+        if self.sound:
+            AmbientSound.stop_all()
+        self.active_actors = []
+        self.active_dirty = True
+        self.actors = SlotMap()
+        self.actors_by_type = {}
+        self.camera_x = 0
+        self.camera_y = 0
+        self.camera_target = None
+        self.dropped_ticks = 0
+        self.dt = 0
+        self.game_lost = False
+        self.game_over = False
+        self.mothership = None
+        self.particles = SlotMap()
+        self.player = None
+        self.random = RandomStreams(self.seed)
+        self.particle_engine.reset()
+        self.remove_queue = []
+        self.spawn_queue = []
+        self.spatial_hash = SpatialHash(self)
+        self.ticks = 0
+        self.time = 0
+
+    def restart(self):
+        """Start the game over, reusing everything that was loaded."""
+        start = time.perf_counter()
+        if self.recorder:
+            self.recorder.restart()
+        for particle in self.particles:
+            self.particle_pools[type(particle)].release(particle)
+        self.reset()
+        self.score.reset()
+        self.world.map.reset()
+        self.spawn_snapshot()
+        logging.info('restarted in %.3fms',
+                     (time.perf_counter() - start) * 1000.0)
+
+    def run(self, ticks):
+        """Run the simulation as fast as possible, without drawing anything.
+
+        :param int ticks: Number of fixed updates to run. This stops early if
+            the game ends, or if a replay runs out of input.
+        :returns: Number of seconds the updates took.
+        """
+        start = time.perf_counter()
+        for i in range(ticks):
+            if self.game_over or (self.replay and self.replay.finished):
+                break
+            self.tick()
+        return time.perf_counter() - start
 
     def screenshot(self):
         filename = 'screenshot_%d.png' % time.time()
@@ -191,12 +386,144 @@ class Game(object):
         pyglet.image.get_buffer_manager().get_color_buffer().save(filename)
 
     def spawn(self, actor_cls, *args, **kwargs):
-        actor = actor_cls(self, *args, **kwargs)
-        if isinstance(actor, Particle):
-            self.particles.append(actor)
-            return actor
-        self.actors.append(actor)
-        if actor.CELL_TYPE not in self.actors_by_type:
-            self.actors_by_type[actor.CELL_TYPE] = []
-        self.actors_by_type[actor.CELL_TYPE].append(actor)
+        """Create an actor, and queue it to be added at the end of the tick.
+
+        Actors and particles aren't added to the game straight away, so that
+        they can't change the lists while they're being updated. A new actor
+        won't be updated until the tick after it was spawned.
+
+        Batched particles are handed to the particle engine instead, and
+        this returns None for them.
+        """
+        if getattr(actor_cls, 'BATCHED', False):
+            self.particle_engine.spawn(actor_cls, *args, **kwargs)
+            return None
+        if issubclass(actor_cls, Particle):
+            pool = self.particle_pools.get(actor_cls)
+            if pool is None:
+                pool = self.particle_pools[actor_cls] = ParticlePool(actor_cls)
+            actor = pool.acquire(self, *args, **kwargs)
+        else:
+            actor = actor_cls(self, *args, **kwargs)
+        self.spawn_queue.append(actor)
         return actor
+
+    def spawn_snapshot(self):
+        """Spawn all of the actors from the snapshot taken by load()."""
+        for cls, x, y in self.snapshot:
+            self.spawn(cls, x=x, y=y)
+        self.flush_queues()
+
+        self.player = self.actors_by_type[defs.CELL_HUMAN_PLAYER][0]
+        self.mothership = self.actors_by_type[defs.CELL_ALIEN_MOTHERSHIP][0]
+
+        # Create an arrow pointing to the right, above the player's start point
+        self.spawn(Arrow, self.player.x, self.player.y + 100)
+
+        # Create an arrow pointing toward the rocket, at the end
+        rocket = self.actors_by_type[defs.CELL_HUMAN_ROCKET][0]
+        self.spawn(Arrow, rocket.x - 35, rocket.y - 15)
+        self.flush_queues()
+
+    def tick(self):
+        """Advance the simulation by a single fixed step."""
+        # The replay goes first, as it restarts the game if the recording
+        # was restarted here.
+        if self.replay:
+            self.replay.advance()
+        self.ticks += 1
+        self.time += self.step
+        if self.recorder:
+            self.recorder.record(self.keys)
+        # The camera is also updated here, so that it's in the right place
+        # for culling particles, even when nothing is being drawn.
+        self.update_camera()
+        self.world.map.update()
+        if (self.active_dirty or
+                self.ticks % defs.ACTIVE_REBUILD_TICKS == 0):
+            self.update_active_actors()
+        t = time.perf_counter()
+        # Some actors move others (the player drags the civilians it's
+        # carrying), so remember where everything was before any of them move.
+        for actor in self.active_actors:
+            actor.prev_x = actor.x
+            actor.prev_y = actor.y
+        for actor in self.active_actors:
+            actor.update(self.step)
+            self.spatial_hash.update(actor)
+        t = self.perf.lap('update_actors', t)
+        for particle in self.particles:
+            particle.prev_x = particle.x
+            particle.prev_y = particle.y
+            particle.update(self.step)
+        self.particle_engine.update(self.step)
+        self.perf.lap('update_particles', t)
+        self.flush_queues()
+        self.update_game_over()
+
+    def update_active_actors(self):
+        """Work out which actors are awake, and should be updated.
+
+        Actors are awake if they can't sleep, are attached to something, are
+        within ACTIVE_RANGE of the camera target or the mothership's beam,
+        or are within ACTIVE_MARGIN of the screen, for cameras too big for
+        ACTIVE_RANGE to cover. This is only rebuilt every few ticks, or when
+        actors are added, removed or attached, so that the check doesn't
+        cost more than the updates it saves.
+
+        The camera's size depends on --width and --height, and the window
+        if there is one, so recordings store it, and are played back with
+        the same camera whatever the window is.
+        """
+        self.active_dirty = False
+        target = self.camera_target
+        beam_x = self.mothership.x if self.mothership else None
+        distance = defs.ACTIVE_RANGE
+        margin = defs.ACTIVE_MARGIN
+        left = self.camera_x - margin
+        bottom = self.camera_y - margin
+        right = self.camera_x + self.camera_width + margin
+        top = self.camera_y + self.camera_height + margin
+        active = []
+        for actor in self.actors:
+            if (not actor.CAN_SLEEP or actor.anchor or
+                    (abs(actor.x - target.x) <= distance and
+                     abs(actor.y - target.y) <= distance) or
+                    (left <= actor.x <= right and
+                     bottom <= actor.y <= top) or
+                    (beam_x is not None and
+                     abs(actor.x - beam_x) <= distance)):
+                active.append(actor)
+            else:
+                # Keep sleeping actors from being interpolated.
+                actor.prev_x = actor.x
+                actor.prev_y = actor.y
+        self.active_actors = active
+
+    def update_camera(self, alpha=1.0):
+        """Center the camera on its target, keeping it inside the map.
+
+        :param float alpha: How far between the target's previous and
+            current position to look, as for Actor.interpolate().
+        """
+        if self.camera_target is None:
+            self.camera_target = self.player
+        x, y = self.camera_target.interpolate(alpha)
+        self.camera_x = x - self.camera_width / 2
+        self.camera_y = y - self.camera_height / 2
+        if self.camera_x < 0:
+            self.camera_x = 0
+        if self.camera_y < 0:
+            self.camera_y = 0
+        if self.camera_y > 800:
+            self.camera_y = 800
+
+    def update_game_over(self):
+        if (self.player.has_rocket and
+                self.player.y > 900 + self.camera_height):
+            self.game_over = True
+            self.game_lost = False
+        if self.player.y < 0 or self.player.x < self.mothership.x:
+            self.game_over = True
+            self.game_lost = True
+        self.on_game_over()
@@ -54,6 +54,8 @@ def create_shader(shader_type, source):
     :raises ValueError: if there is an error compiling the shader.
     """
     # turn source into a char[]
+    if isinstance(source, str):
+        source = source.encode('utf-8')
     c_source = ctypes.create_string_buffer(source)
 
     # get a char ** pointing to the char[]
@@ -1,12 +1,11 @@
 from __future__ import absolute_import
 import math
-import random
 
 import pyglet
 from pyglet.window.key import LEFT, RIGHT, SPACE
 
 from . import defs
-from .actors import Actor, register_actor
+from .actors import COLLIDE_ALL, Actor, register_actor
 from .aliens import Mothership
 from .particles import (
     JetpackFlame, JetpackIgniteSmoke, JetpackSmoke, RocketFlame,
@@ -27,6 +26,8 @@ class Civilian(Actor):
     OFFSET_Y = 2
     POINTS = 50
 
+    __slots__ = ('dead', 'offset', 'platform', 'player')
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.dead = False
@@ -36,7 +37,7 @@ class Civilian(Actor):
 
     def attach(self, anchor):
         super().attach(anchor)
-        self.COLLIDE_WITH_ACTORS = True
+        self.collide_mask = COLLIDE_ALL
         if isinstance(anchor, Player):
             self.player = anchor
             self.game.score.add('points', self.POINTS / 10,
@@ -47,14 +48,14 @@ class Civilian(Actor):
         if self.player:
             self.player.on_detached(self)
             self.player = None
-        self.COLLIDE_WITH_ACTORS = Civilian.COLLIDE_WITH_ACTORS
-        self.GRAVITY = Civilian.GRAVITY
+        self.collide_mask = Civilian.COLLIDE_MASK
+        self.gravity = Civilian.GRAVITY
 
     def on_cell(self, cell):
         if cell.type == defs.CELL_HUMAN_RESCUE:
             self.detach()
-            self.COLOR = self.COLOR_RESCUED
-            self.COLLIDE_WITH_ACTORS = False
+            self.color = self.COLOR_RESCUED
+            self.collide_mask = 0
             cell['platform'].rescue(self)
 
     def on_collide(self, actor, collision):
@@ -67,16 +68,19 @@ class Civilian(Actor):
         if self.player or isinstance(actor, Mothership):
             Sound(self, 'civilian_death.wav', volume=0.5).play()
             self.detach()
-            self.COLLIDE_WITH_ACTORS = False
-            self.COLOR = (0, 0, 0, 1)
+            self.collide_mask = 0
+            self.color = (0, 0, 0, 1)
             self.dead = True
             self.game.score.add(self.game.score.HUMANS_LOST, 1)
-            text = self.game.spawn(Text, random.choice(self.DEATH_TEXT))
+            text = self.game.spawn(
+                Text, self.game.random.humans.choice(self.DEATH_TEXT))
             text.attach(self)
 
     def update(self, dt):
         if self.x < self.game.mothership.x and not self.dead:
             self.on_damage(self.game.mothership)
+        if self.player:
+            return  # the player moves the whole chain, see update_civilians
         super().update(dt)
         if self.platform:
             # FIXME: need to clamp to right side as well ... keep them on it
@@ -85,6 +89,19 @@ class Civilian(Actor):
             if self.y < self.platform.y:
                 self.y = self.platform.y
 
+    def update_carried(self, dt):
+        """Move with the chain of civilians that the player is carrying.
+
+        This is the same as Actor.update(), without colliding with other
+        actors. Player.update_civilians() does that for the whole chain.
+        """
+        self._update_attached(dt)
+        if self.x != self.old_x or self.y != self.old_y:
+            self._collide_with_world()
+        self._update_attached_distance(dt)
+        self.old_x = self.x
+        self.old_y = self.y
+
 
 @register_actor
 class CivilianCommander(Civilian):
@@ -94,6 +111,8 @@ class CivilianCommander(Civilian):
     NAME = 'Mr. President'
     POINTS = 1000
 
+    __slots__ = ()
+
 
 @register_actor
 class CivilianScientist(Civilian):
@@ -103,10 +122,13 @@ class CivilianScientist(Civilian):
     NAME = 'Scientist'
     POINTS = 250
 
+    __slots__ = ()
+
 
 @register_actor
 class Player(Actor):
 
+    CAN_SLEEP = False
     CELL_TYPE = defs.CELL_HUMAN_PLAYER
     JETPACK_IGNITE_DELAY = 0.1
     JETPACK_IGNITE_PARTICLES = 35
@@ -117,6 +139,9 @@ class Player(Actor):
     PUSH_WALK_AIR = 64
     Z = defs.Z_PLAYER
 
+    __slots__ = ('civilians', 'has_jetpack', 'has_rocket',
+                 'jetpack_ignite_time', 'jetpack_ignited', 'space_pressed')
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.civilians = []
@@ -125,7 +150,7 @@ class Player(Actor):
         self.space_pressed = False
         self.has_jetpack = True
         self.has_rocket = False
-        if defs.SOUND:
+        if self.game.sound:
             pyglet.media.listener.position = (self.x, self.y, 0)
             pyglet.media.listener.forward_orientation = (0, 0, 1)
             pyglet.media.listener.up_orientation = (0, 1, 0)
@@ -170,10 +195,12 @@ class Player(Actor):
             flame_cls = JetpackFlame
             smoke_cls = JetpackIgniteSmoke
         self.game.spawn(flame_cls, self.x, self.y, self.game.time)
+        uniform = self.game.random.humans.uniform
         for i in range(self.JETPACK_IGNITE_PARTICLES):
-            p = self.game.spawn(smoke_cls, self.x, self.y, self.game.time)
-            p.vel_x = random.uniform(-20, -60) * math.copysign(1, self.vel_x)
-            p.vel_y = random.uniform(-20, -60)
+            vel_x = uniform(-20, -60) * math.copysign(1, self.vel_x)
+            vel_y = uniform(-20, -60)
+            self.game.spawn(smoke_cls, self.x, self.y, self.game.time,
+                            vel_x=vel_x, vel_y=vel_y)
 
     def update(self, dt):
         if (self.has_jetpack and not self.jetpack_ignited and
@@ -213,6 +240,7 @@ class Player(Actor):
         else:
             self.jetpack_ignited = False
             self.jetpack_ignite_time = None
+            self.space_pressed = False
         if self.jetpack_ignited:
             if self.has_rocket:
                 flame_classes = [RocketFlame, RocketFlameOrange,
@@ -228,17 +256,52 @@ class Player(Actor):
         # push em
         self.push(px, py)
         super().update(dt)
-        if defs.SOUND:
+        self.update_civilians(dt)
+        if self.game.sound:
             pyglet.media.listener.position = (self.x, self.y, 0)
 
+    def update_civilians(self, dt):
+        """Move the chain of civilians being carried, in a single pass.
+
+        They're moved from the front of the chain to the back, so that each
+        one follows the one in front after it has already moved. Then they
+        collide with other actors as a group, using one spatial hash query
+        for the whole chain. They don't collide with each other, or with
+        the player.
+        """
+        if not self.civilians:
+            return
+        for civilian in self.civilians[:]:
+            if civilian.player is self:
+                civilian.update_carried(dt)
+        chain = [civilian for civilian in self.civilians
+                 if civilian.player is self]
+        if not chain:
+            return
+        x1 = min(civilian.x for civilian in chain)
+        y1 = min(civilian.y for civilian in chain)
+        x2 = max(civilian.x + civilian.width for civilian in chain)
+        y2 = max(civilian.y + civilian.height for civilian in chain)
+        spatial_hash = self.game.spatial_hash
+        skip = set(chain)
+        skip.add(self)
+        others = [actor
+                  for actor in spatial_hash.query(x1, y1, x2 - x1, y2 - y1)
+                  if actor not in skip]
+        for civilian in chain:
+            for actor in others:
+                civilian._collide_with_actor(actor)
+            spatial_hash.update(civilian)
+
     def update_gravity(self):
-        self.GRAVITY = (Actor.GRAVITY +
+        self.gravity = (Actor.GRAVITY +
                         Actor.GRAVITY * 0.1 * len(self.civilians))
 
 
 @register_actor
 class RescuePlatform(Actor):
 
+    CAN_SLEEP = False
     CELL_TYPE = defs.CELL_HUMAN_RESCUE
     COLOR = (0, 1, 1, 0.25)
     LABEL_Y = 25
@@ -248,6 +311,10 @@ class RescuePlatform(Actor):
     RESCUE_COLOR_FADE_SPEED = 20
     RESCUE_DELAY = 10.0
 
+    __slots__ = ('activate_sound', 'cell2', 'label', 'next_ping_sound',
+                 'ping_sound', 'rescue_actors', 'rescue_time',
+                 'teleport_sound')
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.rescue_actors = []
@@ -259,8 +326,8 @@ class RescuePlatform(Actor):
         self.cell['platform'] = self
         self.x = self.cell.x
         self.y = self.cell.y
-        self.WIDTH = self.cell.width
-        self.HEIGHT = self.cell.height
+        self.width = self.cell.width
+        self.height = self.cell.height
         # also be the platform for the cell to our right, if it's also a rescue
         # platform... hack since we don't have spawns for 2-wide cells
         c = self.cell.neighbors.right
@@ -269,7 +336,7 @@ class RescuePlatform(Actor):
                 self.game.remove(c.platform)
             c['platform'] = self
             self.cell2 = c
-            self.WIDTH += self.cell2.width
+            self.width += self.cell2.width
         else:
             self.cell2 = None
         self.label = self.game.draw.create_label(6)
@@ -287,8 +354,8 @@ class RescuePlatform(Actor):
             a += (self.RESCUE_COLOR_FADE *
                   math.sin(self.game.time * self.RESCUE_COLOR_FADE_SPEED))
         else:
-            r, g, b, a = self.COLOR
-        self.game.draw.quad(self.x, self.y, self.WIDTH, self.HEIGHT, self.Z,
+            r, g, b, a = self.color
+        self.game.draw.quad(self.x, self.y, self.width, self.height, self.Z,
                             c1=(r, g, b, 0), c3=(r, g, b, a))
         if self.rescue_time:
             time = int(self.rescue_time - self.game.time)
@@ -298,11 +365,12 @@ class RescuePlatform(Actor):
                 self.label.text = 'teleporting'
             else:
                 self.label.text = 'teleporting in %d' % time
-            self.game.draw.label(self.label, self.x + self.WIDTH * 0.5,
+            self.game.draw.label(self.label, self.x + self.width * 0.5,
                                  self.y + self.LABEL_Y)
 
     def rescue(self, actor):
-        self.rescue_actors.append(actor)
+        if actor not in self.rescue_actors:
+            self.rescue_actors.append(actor)
         if not self.rescue_time:
             self.rescue_time = self.game.time + self.RESCUE_DELAY
             self.activate_sound.play()
@@ -317,7 +385,7 @@ class RescuePlatform(Actor):
             return
         if self.rescue_time <= self.game.time:
             self.teleport_sound.play()
-            a = [act for act in set(self.rescue_actors) if not act.dead]
+            a = [act for act in self.rescue_actors if not act.dead]
             n = len(a)
             self.game.score.add(self.game.score.HUMANS_SAVED, n)
             points = 0
@@ -346,16 +414,18 @@ class Rocket(Actor):
     WIDTH = 32
     HEIGHT = 32
 
+    __slots__ = ()
+
     def on_collide(self, actor, collision):
         if not self.anchor and isinstance(actor, Player):
-            actor.old_x = actor.x = (self.x + self.WIDTH * 0.5 -
-                                     actor.WIDTH * 0.5)
+            actor.old_x = actor.x = (self.x + self.width * 0.5 -
+                                     actor.width * 0.5)
             actor.old_y = actor.y = self.y
             self.attach(actor)
 
     def update(self, dt):
         if self.anchor:
-            self.x = self.anchor.x + self.anchor.WIDTH * 0.5 - self.WIDTH * 0.5
+            self.x = self.anchor.x + self.anchor.width * 0.5 - self.width * 0.5
             self.y = self.anchor.y
         else:
             super().update(dt)
@@ -371,6 +441,8 @@ class RocketPad(Actor):
     PHYSICS = defs.PHYSICS_NONE
     Z = defs.Z_MAP_BACKGROUND
 
+    __slots__ = ('cell2',)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.cell = self.game.world.map.get_for_xy(self.x, self.y)
@@ -380,8 +452,8 @@ class RocketPad(Actor):
         self.cell['pad'] = self
         self.x = self.cell.x
         self.y = self.cell.y
-        self.WIDTH = self.cell.width
-        self.HEIGHT = self.cell.height
+        self.width = self.cell.width
+        self.height = self.cell.height
         # also be the platform for the cell to our right, if it's also a rescue
         # platform... hack since we don't have spawns for 2-wide cells
         c = self.cell.neighbors.right
@@ -390,7 +462,7 @@ class RocketPad(Actor):
                 self.game.remove(c.platform)
             c['pad'] = self
             self.cell2 = c
-            self.WIDTH += self.cell2.width
+            self.width += self.cell2.width
         else:
             self.cell2 = None
 
@@ -399,8 +471,8 @@ class RocketPad(Actor):
             return
         f = (math.sin(self.game.time) + 1) * 0.5
         f = f * f
-        r, g, b, a = self.COLOR
-        self.game.draw.quad(self.x, self.y, self.WIDTH, self.HEIGHT, self.Z,
+        r, g, b, a = self.color
+        self.game.draw.quad(self.x, self.y, self.width, self.height, self.Z,
                             c1=(r, g, b, 0), c3=(r, g, b, 0.1 + 0.3 * f))
 
     def update(self, dt):
@@ -0,0 +1,145 @@
+"""Draw maps from baked chunks of cells.
+
+The map never changes, so each square of MAP_CHUNK_SIZE cells is turned
+into vertex lists the first time it's on screen, and kept after that. A
+frame only has to draw the chunks that overlap the camera, instead of
+queuing a quad or a blit for every cell.
+
+Each chunk has untextured quads for the solid black cells, and textured
+quads for everything else, with a vertex list for each atlas page that its
+tiles are on. Tilesets are normally all on the first page, so drawing the
+map binds one texture.
+"""
+from __future__ import absolute_import
+
+import pyglet
+from pyglet import gl
+
+from . import defs
+
+
+class MapChunk(object):
+
+    """MapChunk holds the vertex lists for one square of cells.
+
+    solid is a vertex list or None, and tiled is a list of ``(texture,
+    vertex_list)`` pairs.
+    """
+
+    __slots__ = ('solid', 'tiled')
+
+    def __init__(self, solid, tiled):
+        self.solid = solid
+        self.tiled = tiled
+
+
+class MapRenderer(object):
+
+    """MapRenderer draws the cells of a Map.
+
+    GL objects are only made when something is drawn, so this can be
+    created without a window.
+    """
+
+    def __init__(self, map):
+        self.map = map
+        self.chunks = {}
+
+    def draw(self, min_cx, min_cy, max_cx, max_cy, z):
+        """Draw the chunks that overlap a range of cells.
+
+        :param int min_cx: Left column to draw.
+        :param int min_cy: Bottom row to draw.
+        :param int max_cx: Right column to draw (inclusive).
+        :param int max_cy: Top row to draw (inclusive).
+        :param float z: Layer the map is on.
+        """
+        size = defs.MAP_CHUNK_SIZE
+        chunks = []
+        for chunk_y in range(min_cy // size, max_cy // size + 1):
+            for chunk_x in range(min_cx // size, max_cx // size + 1):
+                key = (chunk_x, chunk_y)
+                chunk = self.chunks.get(key)
+                if chunk is None:
+                    chunk = self.chunks[key] = self._build_chunk(
+                        chunk_x, chunk_y, z)
+                chunks.append(chunk)
+
+        for chunk in chunks:
+            if chunk.solid:
+                chunk.solid.draw(gl.GL_QUADS)
+        # The current colour is undefined after drawing with a colour array,
+        # and the tiles are modulated by it.
+        gl.glColor3f(1, 1, 1)
+        gl.glPushAttrib(gl.GL_ENABLE_BIT)
+        bound = None
+        for chunk in chunks:
+            for texture, vertex_list in chunk.tiled:
+                if texture is not bound:
+                    if bound is None:
+                        gl.glEnable(texture.target)
+                    gl.glBindTexture(texture.target, texture.id)
+                    bound = texture
+                vertex_list.draw(gl.GL_QUADS)
+        gl.glPopAttrib()
+        gl.glColor3f(1, 1, 1)
+
+    def forget(self, min_cx, min_cy, max_cx, max_cy):
+        """Free the chunks that overlap a range of cells.
+
+        They'll be built again if they're drawn.
+        """
+        size = defs.MAP_CHUNK_SIZE
+        for chunk_y in range(min_cy // size, max_cy // size + 1):
+            for chunk_x in range(min_cx // size, max_cx // size + 1):
+                chunk = self.chunks.pop((chunk_x, chunk_y), None)
+                if chunk is None:
+                    continue
+                if chunk.solid:
+                    chunk.solid.delete()
+                for texture, vertex_list in chunk.tiled:
+                    vertex_list.delete()
+
+    def _build_chunk(self, chunk_x, chunk_y, z):
+        map = self.map
+        size = defs.MAP_CHUNK_SIZE
+        tile_width = map.tileset.tile_width
+        tile_height = map.tileset.tile_height
+        tile_images = map.tileset.tiles
+        solid = []
+        tiled = {}
+        for cy in range(chunk_y * size, min(map.height, (chunk_y + 1) * size)):
+            row = cy * map.width
+            for cx in range(chunk_x * size,
+                            min(map.width, (chunk_x + 1) * size)):
+                tile = map.tiles[row + cx]
+                if not tile:
+                    continue
+                x = tile_width * cx
+                y = tile_height * cy
+                x2 = x + tile_width
+                y2 = y + tile_height
+                # bottom left, bottom right, top right, top left
+                vertices = (x, y, z, x2, y, z, x2, y2, z, x, y2, z)
+                if (not map.types[row + cx] and
+                        not map.bounds[row + cx] & defs.CELL_EDGE_SLOPE):
+                    solid.extend(vertices)
+                    continue
+                # Tiles are regions of an atlas page, which is their owner.
+                image = tile_images[tile - 1]
+                if image.owner not in tiled:
+                    tiled[image.owner] = ([], [])
+                tiled_vertices, tex_coords = tiled[image.owner]
+                tiled_vertices.extend(vertices)
+                tex_coords.extend(image.tex_coords)
+        if solid:
+            solid = pyglet.graphics.vertex_list(
+                len(solid) // 3, ('v3f/static', solid),
+                ('c3B/static', (0, 0, 0) * (len(solid) // 3)))
+        else:
+            solid = None
+        return MapChunk(solid, [
+            (texture, pyglet.graphics.vertex_list(
+                len(vertices) // 3, ('v3f/static', vertices),
+                ('t3f/static', tex_coords)))
+            for texture, (vertices, tex_coords) in tiled.items()])
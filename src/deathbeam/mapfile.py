@@ -0,0 +1,249 @@
+"""Binary map files.
+
+A map file holds the grids for one map, laid out the same way Map keeps
+them: bottom row first, indexed by ``cy * width + cx``. The file is a
+HEADER, then a LAYER header and data for each of tiles, types and bounds,
+in that order. Layer data is either stored as is, or compressed with zlib.
+
+Files are memory-mapped when they're read, so each grid is copied (or
+decompressed) straight out of the mapping into its array, without making
+a Python object for every cell.
+
+Chunked map files are for maps too big to load all at once. They have a
+CHUNKED_HEADER, then a table with the offset and size of every chunk, then
+a zlib compressed index of where each cell type is, then the chunks. Each
+chunk is a square of cells with its tiles, types and bounds compressed
+together, so ChunkedMapFile can read any one of them on its own.
+"""
+from __future__ import absolute_import
+import array
+import collections
+import mmap
+import struct
+import sys
+import zlib
+
+
+HEADER = struct.Struct('<4sBxHII')  # magic, version, layers, width, height
+LAYER = struct.Struct('<4sBBxxI')  # name, encoding, item size, data size
+MAGIC = b'DBMP'
+VERSION = 1
+
+# magic, version, chunk size, width, height, type index size
+CHUNKED_HEADER = struct.Struct('<4sBxHIII')
+CHUNK = struct.Struct('<QI')  # offset, size
+CHUNKED_MAGIC = b'DBMC'
+
+ENCODING_RAW = 0
+ENCODING_ZLIB = 1
+
+# Layer names and the array type codes they're stored as. Bytes are stored
+# as bytearrays, and anything wider as a little-endian array.
+LAYERS = ((b'tile', 'H'), (b'type', 'B'), (b'bnds', 'B'))
+
+MapData = collections.namedtuple('MapData',
+                                 'width height tiles types bounds')
+
+
+def _compress_grids(grids):
+    data = []
+    for (name, typecode), cells in zip(LAYERS, grids):
+        grid = _new_grid(typecode)
+        grid.extend(cells)
+        if not isinstance(grid, bytearray) and sys.byteorder == 'big':
+            grid.byteswap()
+        data.append(bytes(grid))
+    return zlib.compress(b''.join(data), 9)
+
+
+def _new_grid(typecode):
+    if typecode == 'B':
+        return bytearray()
+    return array.array(typecode)
+
+
+def _fill_grid(grid, data):
+    if isinstance(grid, bytearray):
+        grid[:] = data
+    else:
+        grid.frombytes(data)
+        if sys.byteorder == 'big':
+            grid.byteswap()
+
+
+def read(filename):
+    """Read the grids from a map file.
+
+    :returns: MapData, with bytearrays and arrays in the same format as
+        Map's grids.
+    """
+    with open(filename, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data, \
+            memoryview(data) as view:
+        magic, version, num_layers, width, height = HEADER.unpack_from(view)
+        if (magic != MAGIC or version != VERSION or
+                num_layers != len(LAYERS)):
+            raise ValueError('{} is not a map file'.format(filename))
+        offset = HEADER.size
+        grids = []
+        for expected_name, typecode in LAYERS:
+            name, encoding, item_size, size = LAYER.unpack_from(view, offset)
+            offset += LAYER.size
+            grid = _new_grid(typecode)
+            if (name != expected_name or
+                    item_size != struct.calcsize(typecode)):
+                raise ValueError('{} has a bad {} layer'.format(
+                    filename, expected_name.decode()))
+            with view[offset:offset + size] as layer:
+                if encoding == ENCODING_ZLIB:
+                    _fill_grid(grid, zlib.decompress(layer))
+                elif encoding == ENCODING_RAW:
+                    _fill_grid(grid, layer)
+                else:
+                    raise ValueError('{} has an unknown encoding {}'.format(
+                        filename, encoding))
+            offset += size
+            if len(grid) != width * height:
+                raise ValueError('{} has a short {} layer'.format(
+                    filename, expected_name.decode()))
+            grids.append(grid)
+    return MapData(width, height, *grids)
+
+
+def write(filename, width, height, tiles, types, bounds, compress=True):
+    """Write grids to a map file.
+
+    :param tiles: Sequences of width * height cells, bottom row first.
+    :param bool compress: Compress the layers with zlib. Uncompressed
+        layers are bigger, but are copied out of the file without doing any
+        work.
+    """
+    with open(filename, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(LAYERS), width, height))
+        for (name, typecode), cells in zip(LAYERS, (tiles, types, bounds)):
+            grid = _new_grid(typecode)
+            grid.extend(cells)
+            if len(grid) != width * height:
+                raise ValueError('{} layer should have {} cells'.format(
+                    name.decode(), width * height))
+            if not isinstance(grid, bytearray) and sys.byteorder == 'big':
+                grid.byteswap()
+            data = bytes(grid)
+            if compress:
+                encoding = ENCODING_ZLIB
+                data = zlib.compress(data, 9)
+            else:
+                encoding = ENCODING_RAW
+            item_size = struct.calcsize(typecode)
+            f.write(LAYER.pack(name, encoding, item_size, len(data)))
+            f.write(data)
+
+
+def is_chunked(filename):
+    """Check if a map file is a chunked one."""
+    with open(filename, 'rb') as f:
+        return f.read(len(CHUNKED_MAGIC)) == CHUNKED_MAGIC
+
+
+def write_chunked(filename, width, height, tiles, types, bounds, chunk_size):
+    """Write grids to a chunked map file.
+
+    :param tiles: Sequences of width * height cells, bottom row first.
+    :param int chunk_size: Number of cells on each side of a chunk. Chunks
+        on the top and right edges are filled out with empty cells.
+    """
+    chunks_x = (width + chunk_size - 1) // chunk_size
+    chunks_y = (height + chunk_size - 1) // chunk_size
+    type_index = [array.array('I') for i in range(256)]
+    for i, cell_type in enumerate(types):
+        if cell_type:
+            type_index[cell_type].append(i)
+    counts = array.array('I', (len(indexes) for indexes in type_index))
+    for indexes in [counts] + type_index:
+        if sys.byteorder == 'big':
+            indexes.byteswap()
+    type_index = zlib.compress(
+        b''.join(bytes(indexes) for indexes in [counts] + type_index), 9)
+
+    chunks = []
+    for chunk_y in range(chunks_y):
+        for chunk_x in range(chunks_x):
+            grids = ([], [], [])
+            for cy in range(chunk_y * chunk_size, (chunk_y + 1) * chunk_size):
+                start = cy * width + chunk_x * chunk_size
+                cells = max(0, min(chunk_size, width - chunk_x * chunk_size))
+                if cy >= height:
+                    cells = 0
+                for grid, source in zip(grids, (tiles, types, bounds)):
+                    grid.extend(source[start:start + cells])
+                    grid.extend([0] * (chunk_size - cells))
+            chunks.append(_compress_grids(grids))
+
+    with open(filename, 'wb') as f:
+        f.write(CHUNKED_HEADER.pack(CHUNKED_MAGIC, VERSION, chunk_size,
+                                    width, height, len(type_index)))
+        offset = (CHUNKED_HEADER.size + CHUNK.size * len(chunks) +
+                  len(type_index))
+        for data in chunks:
+            f.write(CHUNK.pack(offset, len(data)))
+            offset += len(data)
+        f.write(type_index)
+        for data in chunks:
+            f.write(data)
+
+
+class ChunkedMapFile(object):
+
+    """ChunkedMapFile reads chunks from a chunked map file.
+
+    The file stays memory-mapped until it's closed. read_chunk() can be
+    called from any thread.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.chunk_size, self.width, self.height,
+         type_index_size) = CHUNKED_HEADER.unpack_from(self.data)
+        if magic != CHUNKED_MAGIC or version != VERSION:
+            self.data.close()
+            raise ValueError('{} is not a chunked map file'.format(filename))
+        self.chunks_x = (self.width + self.chunk_size - 1) // self.chunk_size
+        self.chunks_y = (self.height + self.chunk_size - 1) // self.chunk_size
+        offset = CHUNKED_HEADER.size
+        self.chunks = [
+            CHUNK.unpack_from(self.data, offset + CHUNK.size * i)
+            for i in range(self.chunks_x * self.chunks_y)]
+        offset += CHUNK.size * len(self.chunks)
+        type_index = array.array('I')
+        type_index.frombytes(
+            zlib.decompress(self.data[offset:offset + type_index_size]))
+        if sys.byteorder == 'big':
+            type_index.byteswap()
+        self.type_index = {}
+        start = 256
+        for cell_type in range(256):
+            count = type_index[cell_type]
+            self.type_index[cell_type] = type_index[start:start + count]
+            start += count
+
+    def close(self):
+        self.data.close()
+
+    def read_chunk(self, chunk_x, chunk_y):
+        """Read the cells in one chunk.
+
+        :returns: MapData for a chunk_size square of cells.
+        """
+        offset, size = self.chunks[chunk_y * self.chunks_x + chunk_x]
+        data = zlib.decompress(self.data[offset:offset + size])
+        cells = self.chunk_size * self.chunk_size
+        grids = []
+        for name, typecode in LAYERS:
+            grid = _new_grid(typecode)
+            size = cells * struct.calcsize(typecode)
+            _fill_grid(grid, data[:size])
+            data = data[size:]
+            grids.append(grid)
+        return MapData(self.chunk_size, self.chunk_size, *grids)
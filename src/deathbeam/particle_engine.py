@@ -0,0 +1,252 @@
+"""Structure-of-arrays storage and simulation for simple particles.
+
+Particle classes with ``BATCHED = True`` don't get a Python object per
+particle. Each class gets a :class:`ParticleBatch` instead, which stores the
+position, velocity and spawn and death times of all of its particles in
+NumPy arrays, and updates and draws them in one go. The class's tuning
+constants (``COLOR``, ``GRAVITY``, ``DRAG``, ``LIFE_TIME``, ``WIDTH``...)
+apply to every particle in the batch.
+
+Batched particles can't collide with anything, be attached to actors, or
+override update() or draw().
+"""
+from __future__ import absolute_import
+
+import numpy
+
+from . import defs
+from .particle_renderer import (
+    COLOR, INSTANCE_FIELDS, INV_LIFE_TIME, LIFE_LEFT)
+
+
+# Rows in ParticleBatch.data
+X = 0
+Y = 1
+PREV_X = 2
+PREV_Y = 3
+VEL_X = 4
+VEL_Y = 5
+SPAWN_TIME = 6
+DEATH_TIME = 7
+FIELDS = 8
+
+
+class ParticleBatch(object):
+
+    INITIAL_CAPACITY = 256
+
+    def __init__(self, cls):
+        self.cls = cls
+        self.count = 0
+        self.data = numpy.zeros((FIELDS, self.INITIAL_CAPACITY))
+        self.high_water = 0
+        self.pending = []
+
+    def draw(self, game, alpha):
+        if not self.count:
+            return
+        cls = self.cls
+        data = self.data[:, :self.count]
+        time = game.time
+        visible = data[SPAWN_TIME] <= time
+        if not visible.all():
+            data = data[:, visible]
+        n = data.shape[1]
+        if not n:
+            return
+        instances = numpy.empty((n, INSTANCE_FIELDS), dtype=numpy.float32)
+        instances[:, 0] = data[PREV_X] + (data[X] - data[PREV_X]) * alpha
+        instances[:, 1] = data[PREV_Y] + (data[Y] - data[PREV_Y]) * alpha
+        instances[:, 2] = cls.WIDTH
+        instances[:, 3] = cls.HEIGHT
+        instances[:, COLOR] = cls.COLOR
+        if cls.LIFE_FADE and cls.LIFE_TIME is not None:
+            instances[:, LIFE_LEFT] = data[DEATH_TIME] - time
+            instances[:, INV_LIFE_TIME] = 1.0 / cls.LIFE_TIME
+        else:
+            instances[:, LIFE_LEFT] = 0.0
+            instances[:, INV_LIFE_TIME] = 0.0
+        game.draw.particles(cls.Z, instances)
+
+    def drop(self, indexes):
+        """Remove the particles at some indexes, keeping the rest in order."""
+        keep = numpy.ones(self.count, dtype=bool)
+        keep[indexes] = False
+        data = self.data[:, :self.count][:, keep]
+        self.count = data.shape[1]
+        self.data[:, :self.count] = data
+
+    def flush(self, random, bounds):
+        """Move the particles spawned since the last flush into the arrays.
+
+        :param numpy.random.RandomState random: Used to scatter the new
+            particles by the class's RANDOM_* amounts.
+        :param tuple bounds: Left, bottom, right and top of the area that
+            particles can spawn in. Any outside it are dropped.
+        """
+        if not self.pending:
+            return
+        cls = self.cls
+        new = numpy.array(self.pending).T
+        self.pending = []
+        left, bottom, right, top = bounds
+        inside = ((new[0] >= left) & (new[0] <= right) &
+                  (new[1] >= bottom) & (new[1] <= top))
+        if not inside.all():
+            new = new[:, inside]
+        k = new.shape[1]
+        if not k:
+            return
+        if self.count + k > self.data.shape[1]:
+            capacity = self.data.shape[1]
+            while capacity < self.count + k:
+                capacity *= 2
+            data = numpy.zeros((FIELDS, capacity))
+            data[:, :self.count] = self.data[:, :self.count]
+            self.data = data
+        data = self.data[:, self.count:self.count + k]
+        data[X] = new[0] + random.uniform(-cls.RANDOM_X, cls.RANDOM_X, k)
+        data[Y] = new[1] + random.uniform(-cls.RANDOM_Y, cls.RANDOM_Y, k)
+        data[PREV_X] = data[X]
+        data[PREV_Y] = data[Y]
+        data[VEL_X] = new[2] + random.uniform(-cls.RANDOM_VEL_X,
+                                              cls.RANDOM_VEL_X, k)
+        data[VEL_Y] = new[3] + random.uniform(-cls.RANDOM_VEL_Y,
+                                              cls.RANDOM_VEL_Y, k)
+        data[SPAWN_TIME] = new[4]
+        if cls.LIFE_TIME is None:
+            data[DEATH_TIME] = numpy.inf
+        else:
+            data[DEATH_TIME] = new[4] + cls.LIFE_TIME
+        self.count += k
+        if self.count > self.high_water:
+            self.high_water = self.count
+
+    def update(self, time, dt):
+        if not self.count:
+            return
+        cls = self.cls
+        data = self.data[:, :self.count]
+
+        # Remove dead particles, keeping the rest in spawn order.
+        alive = data[DEATH_TIME] >= time
+        if not alive.all():
+            self.count = int(numpy.count_nonzero(alive))
+            self.data[:, :self.count] = data[:, alive]
+            data = self.data[:, :self.count]
+            if not self.count:
+                return
+
+        # This is Actor._update_velocity, for every particle at once.
+        # Particles that haven't reached their spawn time yet stay put.
+        data[PREV_X] = data[X]
+        data[PREV_Y] = data[Y]
+        active = data[SPAWN_TIME] <= time
+        if active.all():
+            step, gravity, drag = dt, cls.GRAVITY, cls.DRAG
+        else:
+            step = dt * active
+            gravity = cls.GRAVITY * active
+            drag = numpy.where(active, cls.DRAG, 1.0)
+        data[X] += data[VEL_X] * step
+        data[Y] += data[VEL_Y] * step
+        data[Y] -= gravity
+        data[VEL_X] *= drag
+        data[VEL_Y] *= drag
+        for row in (VEL_X, VEL_Y):
+            vel = data[row]
+            vel[numpy.abs(vel) < 0.001] = 0.0
+
+
+class ParticleEngine(object):
+
+    """ParticleEngine owns a batch for each class of batched particle.
+
+    The engine culls particles spawned too far outside the camera, and keeps
+    the total number of particles in the game under a budget by dropping
+    the oldest particles from the classes with the lowest PRIORITY.
+    """
+
+    def __init__(self, game, budget=None):
+        self.game = game
+        self.batches = {}
+        if budget is None:
+            budget = defs.PARTICLE_BUDGET
+        self.budget = budget
+        self.evicted = 0
+        self.random = None
+
+    def __len__(self):
+        return sum(batch.count for batch in self.batches.values())
+
+    def draw(self, alpha):
+        for batch in self.batches.values():
+            batch.draw(self.game, alpha)
+
+    def flush(self):
+        game = self.game
+        margin = defs.PARTICLE_CULL_MARGIN
+        bounds = (game.camera_x - margin, game.camera_y - margin,
+                  game.camera_x + game.camera_width + margin,
+                  game.camera_y + game.camera_height + margin)
+        for batch in self.batches.values():
+            batch.flush(self.random, bounds)
+        excess = len(self) + len(game.particles) - self.budget
+        if excess > 0:
+            self.evict(excess)
+
+    def evict(self, n):
+        """Drop the n oldest particles from the lowest priority classes.
+
+        Classes with the same PRIORITY are treated as one pool, so their
+        particles are dropped in SPAWN_TIME order across all of them,
+        rather than emptying one class before starting on the next.
+        """
+        levels = {}
+        for batch in self.batches.values():
+            if batch.count:
+                levels.setdefault(batch.cls.PRIORITY, []).append(batch)
+        for priority in sorted(levels):
+            batches = levels[priority]
+            times = numpy.concatenate(
+                [batch.data[SPAWN_TIME, :batch.count] for batch in batches])
+            # A stable sort breaks ties by batch, then by spawn order.
+            oldest = numpy.argsort(times, kind='mergesort')[:n]
+            start = 0
+            for batch in batches:
+                end = start + batch.count
+                indexes = oldest[(oldest >= start) & (oldest < end)]
+                if len(indexes):
+                    batch.drop(indexes - start)
+                start = end
+            self.evicted += len(oldest)
+            n -= len(oldest)
+            if n <= 0:
+                break
+
+    def reset(self):
+        """Remove every particle, keeping the arrays to reuse."""
+        for batch in self.batches.values():
+            batch.count = 0
+            batch.pending = []
+        self.evicted = 0
+        self.random = numpy.random.RandomState(
+            self.game.random.particles.getrandbits(32))
+
+    def spawn(self, cls, x=0.0, y=0.0, spawn_time=None, vel_x=0.0,
+              vel_y=0.0):
+        """Queue a particle to be added on the next flush.
+
+        This takes the same arguments as Particle.__init__, except that the
+        only attributes that can be set are vel_x and vel_y.
+        """
+        batch = self.batches.get(cls)
+        if batch is None:
+            batch = self.batches[cls] = ParticleBatch(cls)
+        batch.pending.append(
+            (x, y, vel_x, vel_y, spawn_time or self.game.time))
+
+    def update(self, dt):
+        time = self.game.time
+        for batch in self.batches.values():
+            batch.update(time, dt)
@@ -0,0 +1,181 @@
+"""Instanced rendering for batched particles.
+
+Each particle is one instance of a unit quad. Its rect, colour and life go
+into a single buffer, and every particle on a layer is drawn with one call
+to glDrawArraysInstancedARB. The vertex shader does the life fade that
+Particle.lerp_life() does on the CPU.
+
+If the driver doesn't support instancing or shaders, the instances are
+expanded into vertex and colour arrays and drawn with glDrawArrays.
+"""
+from __future__ import absolute_import
+import ctypes
+import logging
+
+import numpy
+from pyglet import gl
+from pyglet.gl import gl_info
+
+from . import helpers
+
+
+# Columns of the instance array built by ParticleBatch.draw
+RECT = slice(0, 4)       # x, y, width, height
+COLOR = slice(4, 8)      # r, g, b, a
+LIFE_LEFT = 8            # seconds until the particle dies
+INV_LIFE_TIME = 9        # 1.0 / LIFE_TIME, or 0.0 if it doesn't fade
+INSTANCE_FIELDS = 10
+INSTANCE_STRIDE = INSTANCE_FIELDS * 4
+
+VERTEX_SHADER = """
+#version 120
+
+attribute vec2 corner;
+attribute vec4 rect;
+attribute vec4 color;
+attribute vec2 life;
+
+uniform float z;
+
+varying vec4 v_color;
+
+void main() {
+    float fade = 1.0;
+    if (life.y > 0.0) {
+        fade = clamp(life.x * life.y, 0.0, 1.0);
+    }
+    v_color = vec4(color.rgb, color.a * fade);
+    gl_Position = gl_ModelViewProjectionMatrix *
+        vec4(rect.xy + corner * rect.zw, z, 1.0);
+}
+"""
+
+FRAGMENT_SHADER = """
+#version 120
+
+varying vec4 v_color;
+
+void main() {
+    gl_FragColor = v_color;
+}
+"""
+
+
+class ParticleRenderer(object):
+
+    """ParticleRenderer draws arrays of particle instances.
+
+    This must be created while the window's GL context is current.
+    """
+
+    def __init__(self):
+        self.program = None
+        if (gl_info.have_version(2, 0) and
+                gl_info.have_extension('GL_ARB_draw_instanced') and
+                gl_info.have_extension('GL_ARB_instanced_arrays')):
+            try:
+                self.program = helpers.create_program(VERTEX_SHADER,
+                                                      FRAGMENT_SHADER)
+            except ValueError:
+                logging.exception('particle shader failed, not instancing')
+        else:
+            logging.info('instancing unsupported, drawing particles with '
+                         'vertex arrays')
+        if self.program is not None:
+            self.corner_location = gl.glGetAttribLocation(self.program,
+                                                          b'corner')
+            self.instance_locations = (
+                (gl.glGetAttribLocation(self.program, b'rect'), 4, 0),
+                (gl.glGetAttribLocation(self.program, b'color'), 4, 16),
+                (gl.glGetAttribLocation(self.program, b'life'), 2, 32))
+            self.z_location = gl.glGetUniformLocation(self.program, b'z')
+            corners = (gl.GLfloat * 8)(0, 0, 1, 0, 0, 1, 1, 1)
+            self.corner_buffer = gl.GLuint()
+            gl.glGenBuffers(1, ctypes.byref(self.corner_buffer))
+            gl.glBindBuffer(gl.GL_ARRAY_BUFFER, self.corner_buffer)
+            gl.glBufferData(gl.GL_ARRAY_BUFFER, ctypes.sizeof(corners),
+                            corners, gl.GL_STATIC_DRAW)
+            self.instance_buffer = gl.GLuint()
+            gl.glGenBuffers(1, ctypes.byref(self.instance_buffer))
+            gl.glBindBuffer(gl.GL_ARRAY_BUFFER, 0)
+
+    def draw(self, z, instances):
+        """Draw particle instances.
+
+        :param float z: Layer the particles are on.
+        :param list instances: float32 arrays with INSTANCE_FIELDS columns.
+        """
+        if len(instances) == 1:
+            instances = instances[0]
+        else:
+            instances = numpy.concatenate(instances)
+        if self.program is None:
+            self._draw_arrays(z, instances)
+        else:
+            self._draw_instanced(z, instances)
+
+    def _draw_arrays(self, z, instances):
+        n = len(instances)
+        x = instances[:, 0]
+        y = instances[:, 1]
+        x2 = x + instances[:, 2]
+        y2 = y + instances[:, 3]
+
+        # Corners go in the same order as Draw.quad's.
+        vertices = numpy.empty((n, 4, 3), dtype=numpy.float32)
+        vertices[:, 0, 0] = x
+        vertices[:, 0, 1] = y2
+        vertices[:, 1, 0] = x2
+        vertices[:, 1, 1] = y2
+        vertices[:, 2, 0] = x2
+        vertices[:, 2, 1] = y
+        vertices[:, 3, 0] = x
+        vertices[:, 3, 1] = y
+        vertices[:, :, 2] = z
+
+        fade = numpy.where(
+            instances[:, INV_LIFE_TIME] > 0.0,
+            numpy.clip(instances[:, LIFE_LEFT] * instances[:, INV_LIFE_TIME],
+                       0.0, 1.0),
+            1.0)
+        colors = numpy.empty((n, 4, 4), dtype=numpy.float32)
+        colors[:, :, :] = instances[:, None, COLOR]
+        colors[:, :, 3] *= fade[:, None]
+
+        gl.glEnableClientState(gl.GL_VERTEX_ARRAY)
+        gl.glEnableClientState(gl.GL_COLOR_ARRAY)
+        gl.glVertexPointer(3, gl.GL_FLOAT, 0, vertices.ctypes.data)
+        gl.glColorPointer(4, gl.GL_FLOAT, 0, colors.ctypes.data)
+        gl.glDrawArrays(gl.GL_QUADS, 0, n * 4)
+        gl.glDisableClientState(gl.GL_COLOR_ARRAY)
+        gl.glDisableClientState(gl.GL_VERTEX_ARRAY)
+        gl.glColor3f(1, 1, 1)
+
+    def _draw_instanced(self, z, instances):
+        instances = numpy.ascontiguousarray(instances, dtype=numpy.float32)
+        gl.glUseProgram(self.program)
+        gl.glUniform1f(self.z_location, z)
+
+        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, self.corner_buffer)
+        gl.glEnableVertexAttribArray(self.corner_location)
+        gl.glVertexAttribPointer(self.corner_location, 2, gl.GL_FLOAT,
+                                 gl.GL_FALSE, 0, 0)
+
+        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, self.instance_buffer)
+        gl.glBufferData(gl.GL_ARRAY_BUFFER, instances.nbytes,
+                        instances.ctypes.data, gl.GL_STREAM_DRAW)
+        for location, size, offset in self.instance_locations:
+            gl.glEnableVertexAttribArray(location)
+            gl.glVertexAttribPointer(location, size, gl.GL_FLOAT, gl.GL_FALSE,
+                                     INSTANCE_STRIDE, offset)
+            gl.glVertexAttribDivisorARB(location, 1)
+
+        gl.glDrawArraysInstancedARB(gl.GL_TRIANGLE_STRIP, 0, 4,
+                                    len(instances))
+
+        for location, size, offset in self.instance_locations:
+            gl.glVertexAttribDivisorARB(location, 0)
+            gl.glDisableVertexAttribArray(location)
+        gl.glDisableVertexAttribArray(self.corner_location)
+        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, 0)
+        gl.glUseProgram(0)
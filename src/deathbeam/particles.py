@@ -1,6 +1,5 @@
 from __future__ import absolute_import
 import math
-import random
 
 from pyglet import gl
 
@@ -10,11 +9,16 @@ from .actors import Actor
 
 class Particle(Actor):
 
+    # Batched particles are stored and simulated by the ParticleEngine in
+    # arrays, rather than as an object each. Only simple velocity particles
+    # that don't collide with anything can be batched.
+    BATCHED = False
     COLLIDE_WITH_ACTORS = False
     COLLIDE_WITH_WORLD = False
     COLOR = (0.0, 0.0, 0.0, 1.0)
     LIFE_FADE = True
     LIFE_TIME = 1.0
+    PRIORITY = 0  # when over budget, lower priorities are dropped first
     RANDOM_X = 0.0
     RANDOM_Y = 0.0
     RANDOM_VEL_X = 0.0
@@ -23,40 +27,65 @@ class Particle(Actor):
     HEIGHT = 1
     Z = defs.Z_PARTICLE_BACKGROUND
 
-    def __init__(self, game, x=0.0, y=0.0, spawn_time=None, **kwargs):
-        super().__init__(game, x, y)
+    __slots__ = ('death_time', 'life_time', 'spawn_time')
+
+    def __init__(self, game, *args, **kwargs):
+        super().__init__(game)
+        self.reset(*args, **kwargs)
+
+    def lerp_life(self):
+        if self.life_time is None:
+            return 1.0
+        life = (self.death_time - self.game.time) / self.life_time
+        life = helpers.clamp(life, 0.0, 1.0)
+        return life
+
+    def reset(self, x=0.0, y=0.0, spawn_time=None, **kwargs):
+        """Set the particle up as if it had just been created.
+
+        This is called by __init__, and when a particle is taken from a
+        ParticlePool to be reused.
+        """
+        self.x = self.old_x = x
+        self.y = self.old_y = y
+        self.vel_x = 0.0
+        self.vel_y = 0.0
+        self.anchor = None
+        self.cell = None
+        self.on_ground = False
         self.spawn_time = spawn_time or self.game.time
         self.life_time = self.LIFE_TIME
         if self.life_time is not None:
             self.death_time = self.spawn_time + self.LIFE_TIME
         else:
             self.death_time = None
+        self._old_physics = None
+        self.collide_mask = self.COLLIDE_MASK
         self.color = self.COLOR
+        self.drag = self.DRAG
+        self.gravity = self.GRAVITY
+        self.physics = self.PHYSICS
         self.width = self.WIDTH
         self.height = self.HEIGHT
         for kw in kwargs:
             setattr(self, kw, kwargs[kw])
-        self.x += random.uniform(-self.RANDOM_X, self.RANDOM_X)
-        self.y += random.uniform(-self.RANDOM_Y, self.RANDOM_Y)
-        self.vel_x += random.uniform(-self.RANDOM_VEL_X, self.RANDOM_VEL_X)
-        self.vel_y += random.uniform(-self.RANDOM_VEL_Y, self.RANDOM_VEL_Y)
-
-    def lerp_life(self):
-        if self.life_time is None:
-            return 1.0
-        life = (self.death_time - self.game.time) / self.life_time
-        life = helpers.clamp(life, 0.0, 1.0)
-        return life
+        uniform = self.game.random.particles.uniform
+        self.x += uniform(-self.RANDOM_X, self.RANDOM_X)
+        self.y += uniform(-self.RANDOM_Y, self.RANDOM_Y)
+        self.vel_x += uniform(-self.RANDOM_VEL_X, self.RANDOM_VEL_X)
+        self.vel_y += uniform(-self.RANDOM_VEL_Y, self.RANDOM_VEL_Y)
+        self.prev_x = self.x
+        self.prev_y = self.y
 
     def draw(self):
         if self.game.time < self.spawn_time:
             return
         life = self.lerp_life()
-        alpha = self.COLOR[3]
+        alpha = self.color[3]
         if self.LIFE_FADE:
             alpha *= life
-        self.game.draw.quad(self.x, self.y, self.WIDTH, self.HEIGHT, self.Z,
-                            (self.COLOR[0], self.COLOR[1], self.COLOR[2],
+        self.game.draw.quad(self.x, self.y, self.width, self.height, self.Z,
+                            (self.color[0], self.color[1], self.color[2],
                              alpha))
 
     def update(self, dt):
@@ -68,6 +97,45 @@ class Particle(Actor):
         return super().update(dt)
 
 
+class ParticlePool(object):
+
+    """ParticlePool keeps removed particles of one class for reuse.
+
+    :ivar list free: Particles waiting to be reused.
+    :ivar int in_use: Number of particles handed out and not released yet.
+    :ivar int high_water: Most particles that have been in use at once.
+    """
+
+    def __init__(self, cls):
+        self.cls = cls
+        self.free = []
+        self.in_use = 0
+        self.high_water = 0
+
+    def __len__(self):
+        return len(self.free)
+
+    def acquire(self, game, *args, **kwargs):
+        """Get a particle, reusing a free one if there is one.
+
+        Takes the same arguments as the particle class's constructor.
+        """
+        if self.free:
+            particle = self.free.pop()
+            particle.reset(*args, **kwargs)
+        else:
+            particle = self.cls(game, *args, **kwargs)
+        self.in_use += 1
+        if self.in_use > self.high_water:
+            self.high_water = self.in_use
+        return particle
+
+    def release(self, particle):
+        particle.detach()
+        self.in_use -= 1
+        self.free.append(particle)
+
+
 class Arrow(Particle):
 
     BOUNCE_AMOUNT = 10
@@ -80,21 +148,24 @@ class Arrow(Particle):
     HEIGHT = 16
     Z = defs.Z_PARTICLE_BACKGROUND
 
+    __slots__ = ()
+
     def draw(self):
         if self.game.time < self.spawn_time:
             return
-        self.game.draw.callback(self.draw_callback, z=self.Z)
+        self.game.draw.callback(self.draw_callback, z=self.Z,
+                                phase='draw_particles')
 
     def draw_callback(self, z):
         x, y = self.x, self.y
-        w, h = self.WIDTH, self.HEIGHT
+        w, h = self.width, self.height
         hh = h * 0.5
         f = (math.sin(self.game.time * self.BOUNCE_SPEED) + 1) * 0.5
         f = f * f * f
         x += f * self.BOUNCE_AMOUNT
         gl.glLineWidth(self.LINE_WIDTH)
         gl.glBegin(gl.GL_LINE_STRIP)
-        gl.glColor4f(*self.COLOR)
+        gl.glColor4f(*self.color)
         gl.glVertex3f(x - w, y - hh, z)
         gl.glVertex3f(x - w, y + hh, z)
         gl.glVertex3f(x, y + hh, z)
@@ -108,23 +179,30 @@ class Arrow(Particle):
 
 class JetpackFlame(Particle):
 
+    BATCHED = True
     COLOR = (1.0, 1.0, 0.0, 1.0)
     GRAVITY = 0.1
     LIFE_TIME = 0.2
+    PRIORITY = 1
     RANDOM_X = RANDOM_Y = 1.0
     WIDTH = 2
     HEIGHT = 2
     Z = defs.Z_PARTICLE_BACKGROUND + defs.Z_LAYER_RANGE
 
+    __slots__ = ()
+
 
 class JetpackSmoke(Particle):
 
+    BATCHED = True
     COLOR = (0.0, 0.0, 0.0, 0.3)
     GRAVITY = 0.2
     RANDOM_X = RANDOM_Y = 2
     WIDTH = 2
     HEIGHT = 2
 
+    __slots__ = ()
+
 
 class JetpackIgniteSmoke(JetpackSmoke):
 
@@ -133,16 +211,22 @@ class JetpackIgniteSmoke(JetpackSmoke):
     WIDTH = 2
     HEIGHT = 2
 
+    __slots__ = ()
+
 
 class RocketFlame(Particle):
 
+    BATCHED = True
     COLOR = (1.0, 1.0, 0.0, 1.0)
     GRAVITY = 0.1
     LIFE_TIME = 0.2
+    PRIORITY = 1
     RANDOM_X = RANDOM_Y = 8
     WIDTH = HEIGHT = 4
     Z = defs.Z_PARTICLE_BACKGROUND + defs.Z_LAYER_RANGE
 
+    __slots__ = ()
+
 
 class RocketFlameOrange(RocketFlame):
 
@@ -150,6 +234,8 @@ class RocketFlameOrange(RocketFlame):
     RANDOM_X = 12
     WIDTH = HEIGHT = 6
 
+    __slots__ = ()
+
 
 class RocketFlameRed(RocketFlame):
 
@@ -157,9 +243,12 @@ class RocketFlameRed(RocketFlame):
     RANDOM_X = 16
     WIDTH = HEIGHT = 8
 
+    __slots__ = ()
+
 
 class RocketSmoke(Particle):
 
+    BATCHED = True
     COLOR = (0.0, 0.0, 0.0, 0.3)
     LIFE_TIME = 2
     GRAVITY = 0.2
@@ -168,25 +257,31 @@ class RocketSmoke(Particle):
     WIDTH = 16
     HEIGHT = 16
 
+    __slots__ = ()
+
 
 class RocketIgniteSmoke(JetpackSmoke):
 
+    BATCHED = False
     COLLIDE_WITH_WORLD = True
     RANDOM_X = 64
     RANDOM_Y = 8
     WIDTH = 16
     HEIGHT = 16
 
+    __slots__ = ()
+
 
 class Text(Particle):
 
     GRAVITY = 0
     LIFE_TIME = 2.0
 
-    def __init__(self, game, text, *args, **kwargs):
+    __slots__ = ('label',)
+
+    def __init__(self, game, *args, **kwargs):
+        self.label = game.draw.create_label(6)
         super().__init__(game, *args, **kwargs)
-        self.label = self.game.draw.create_label(6)
-        self.label.text = text
 
     def draw(self):
         if self.game.time < self.spawn_time:
@@ -196,9 +291,13 @@ class Text(Particle):
         self.label.color = [255, 255, 255, int(255.0 * life)]
         x = self.x
         if self.anchor:
-            x += self.anchor.WIDTH + 5
+            x += self.anchor.width + 5
         self.game.draw.label(self.label, x, self.y)
 
+    def reset(self, text, *args, **kwargs):
+        super().reset(*args, **kwargs)
+        self.label.text = text
+
 
 class TurretBullet(Particle):
 
@@ -216,6 +315,8 @@ class TurretBullet(Particle):
     WIDTH = 5
     HEIGHT = 5
 
+    __slots__ = ()
+
     def draw(self):
         if self.game.time < self.spawn_time:
             return
@@ -225,15 +326,16 @@ class TurretBullet(Particle):
         if length:
             nx /= length
             ny /= length
-            self.game.draw.callback(self.draw_callback, nx, ny, z=self.Z)
+            self.game.draw.callback(self.draw_callback, nx, ny, z=self.Z,
+                                    phase='draw_particles')
 
     def draw_callback(self, nx, ny, z):
         gl.glLineWidth(self.BOLT_WIDTH)
         gl.glBegin(gl.GL_LINES)
-        gl.glColor4f(self.COLOR[0], self.COLOR[1], self.COLOR[2], 1)
+        gl.glColor4f(self.color[0], self.color[1], self.color[2], 1)
         gl.glVertex3f(self.x, self.y, z)
-        gl.glColor4f(self.COLOR[0] * 0.7, self.COLOR[1] * 0.7,
-                     self.COLOR[2] * 0.7, 0)
+        gl.glColor4f(self.color[0] * 0.7, self.color[1] * 0.7,
+                     self.color[2] * 0.7, 0)
         gl.glVertex3f(self.x + nx * self.BOLT_LENGTH,
                       self.y + ny * self.BOLT_LENGTH, z)
         gl.glColor3f(1, 1, 1)
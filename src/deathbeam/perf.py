@@ -0,0 +1,112 @@
+from __future__ import absolute_import
+import collections
+import time
+
+from . import defs
+
+
+class PerfHud(object):
+
+    """PerfHud keeps rolling timings for each phase of a frame.
+
+    Timings are always collected, because it's cheap. The overlay showing
+    them is toggled with F3, or turned on at startup with --perf-hud.
+
+    Things are queued to be drawn, and drawn when the queue is flushed.
+    DRAW MAP and DRAW PARTICLES are the parts of FLUSH spent on those.
+    """
+
+    PHASES = (
+        ('update_actors', 'UPDATE ACTORS'),
+        ('update_particles', 'UPDATE PARTICLES'),
+        ('queue_map', 'QUEUE MAP'),
+        ('queue_actors', 'QUEUE ACTORS'),
+        ('queue_particles', 'QUEUE PARTICLES'),
+        ('flush', 'FLUSH'),
+        ('draw_map', 'DRAW MAP'),
+        ('draw_particles', 'DRAW PARTICLES'),
+        ('score', 'SCORE'),
+    )
+    FPS_WINDOW = 1.0  # seconds of frames to count for the frame rate
+    SAMPLES = 120
+    TEXT_INTERVAL = 0.25
+    X = 10
+    TOP_MARGIN = 20
+    LINE_HEIGHT = 12
+
+    def __init__(self, game):
+        self.game = game
+        self.frames = collections.deque()
+        self.labels = None
+        self.next_text_time = 0
+        self.samples = {phase: collections.deque(maxlen=self.SAMPLES)
+                        for phase, name in self.PHASES}
+        self.visible = defs.PERF_HUD
+
+    def add(self, phase, seconds):
+        """Record the time a phase took."""
+        self.samples[phase].append(seconds)
+
+    def average(self, phase):
+        samples = self.samples[phase]
+        if not samples:
+            return 0.0
+        return sum(samples) / len(samples)
+
+    def draw(self):
+        if not self.visible:
+            return
+        if self.labels is None:
+            self.labels = [self.game.draw.create_label(6)
+                           for i in range(len(self.PHASES) + 1)]
+            top = self.game.window.height - self.TOP_MARGIN
+            for i, label in enumerate(self.labels):
+                label.x = self.X
+                label.y = top - i * self.LINE_HEIGHT
+        now = time.perf_counter()
+        if now >= self.next_text_time:
+            # Laying out label text is slow, so only do it now and then.
+            self.next_text_time = now + self.TEXT_INTERVAL
+            self.update_text()
+        for label in self.labels:
+            label.draw()
+
+    def fps(self):
+        """Get the number of frames drawn a second, over FPS_WINDOW."""
+        if len(self.frames) < 2:
+            return 0.0
+        return (len(self.frames) - 1) / (self.frames[-1] - self.frames[0])
+
+    def frame(self):
+        """Count a frame being drawn."""
+        now = time.perf_counter()
+        self.frames.append(now)
+        while now - self.frames[0] > self.FPS_WINDOW:
+            self.frames.popleft()
+
+    def lap(self, phase, start):
+        """Record the time since start for a phase.
+
+        :param str phase: Name of the phase.
+        :param float start: Value of time.perf_counter() when it started.
+        :returns: The current time, so it can start the next phase.
+        """
+        now = time.perf_counter()
+        self.add(phase, now - start)
+        return now
+
+    def toggle(self):
+        self.visible = not self.visible
+
+    def update_text(self):
+        for label, (phase, name) in zip(self.labels, self.PHASES):
+            samples = self.samples[phase]
+            label.text = '%-16s %6.2fMS %6.2fMS' % (
+                name, self.average(phase) * 1000.0,
+                max(samples) * 1000.0 if samples else 0.0)
+        self.labels[-1].text = (
+            'FPS %.1f ACTORS %d/%d PARTICLES %d DROPPED %d' % (
+                self.fps(), len(self.game.active_actors),
+                len(self.game.actors),
+                len(self.game.particles) + len(self.game.particle_engine),
+                self.game.dropped_ticks))
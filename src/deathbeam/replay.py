@@ -0,0 +1,124 @@
+from __future__ import absolute_import
+import logging
+import struct
+import zlib
+
+from pyglet.window.key import LEFT, RIGHT, SPACE, KeyStateHandler
+
+
+logger = logging.getLogger('deathbeam')
+
+# These are the only keys the simulation reads. Each tick is stored as a
+# single byte, with one bit for each of these keys.
+KEYS = (LEFT, RIGHT, SPACE)
+
+# Stored in between ticks when the game was restarted, so that a whole
+# session can be played back from one file.
+RESTART = 0x80
+
+HEADER = struct.Struct('<4sBQd')  # magic, version, seed, step
+CAMERA = struct.Struct('<dd')  # width, height, after the header
+MAGIC = b'DBRP'
+VERSION = 3
+
+
+class Recorder(object):
+
+    """Recorder keeps track of the keys that are held down on each tick.
+
+    :param camera_size: The camera's ``(width, height)``, which changes
+        which actors are awake, so it's needed to play the game back.
+    """
+
+    def __init__(self, filename, seed, step, camera_size):
+        self.filename = filename
+        self.seed = seed
+        self.step = step
+        self.camera_size = camera_size
+        self.ticks = bytearray()
+
+    def record(self, keys):
+        bits = 0
+        for i, key in enumerate(KEYS):
+            if keys[key]:
+                bits |= 1 << i
+        self.ticks.append(bits)
+
+    def restart(self):
+        self.ticks.append(RESTART)
+
+    def save(self):
+        logger.info('writing %d ticks of input to %s', len(self.ticks),
+                    self.filename)
+        with open(self.filename, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, self.seed, self.step))
+            f.write(CAMERA.pack(*self.camera_size))
+            f.write(zlib.compress(bytes(self.ticks)))
+
+
+class Replay(object):
+
+    """Replay plays back the input from a recording, one tick at a time.
+
+    The game uses :attr:`keys` in place of the keyboard, and calls
+    :meth:`advance` at the start of each tick to update it. It also uses
+    :attr:`camera_size` in place of its own, unless it's None.
+
+    :param on_restart: Called when the recording reaches a point where the
+        game was restarted.
+    """
+
+    def __init__(self, filename, on_restart=None):
+        with open(filename, 'rb') as f:
+            data = f.read()
+        magic, version, self.seed, self.step = HEADER.unpack_from(data)
+        # Version 1 can't have any restarts in it, and neither it nor
+        # version 2 has the camera size.
+        if magic != MAGIC or version not in (1, 2, VERSION):
+            raise ValueError('{} is not a recording'.format(filename))
+        offset = HEADER.size
+        self.camera_size = None
+        if version >= 3:
+            self.camera_size = CAMERA.unpack_from(data, offset)
+            offset += CAMERA.size
+        self.filename = filename
+        self.keys = KeyStateHandler()
+        self.on_restart = on_restart
+        self.tick = 0
+        self.ticks = zlib.decompress(data[offset:])
+
+    def __len__(self):
+        return len(self.ticks)
+
+    @property
+    def finished(self):
+        return self.tick >= len(self.ticks)
+
+    def advance(self):
+        """Set :attr:`keys` to the state for the next tick.
+
+        Any restarts recorded before the tick are passed on to on_restart
+        first.
+
+        :returns: False if the recording has run out, in which case all the
+            keys are released.
+        """
+        while not self.finished and self.ticks[self.tick] == RESTART:
+            self.tick += 1
+            if self.on_restart:
+                self.on_restart()
+        if self.finished:
+            self.keys.clear()
+            return False
+        bits = self.ticks[self.tick]
+        for i, key in enumerate(KEYS):
+            self.keys[key] = bool(bits & (1 << i))
+        self.tick += 1
+        if self.finished:
+            logger.info('finished replaying %s', self.filename)
+        return True
+
+    def rewind(self):
+        """Go back to the start of the recording."""
+        self.keys.clear()
+        self.tick = 0
@@ -0,0 +1,20 @@
+from __future__ import absolute_import
+import random
+
+
+class RandomStreams(object):
+
+    """RandomStreams gives each subsystem its own random number generator.
+
+    Every stream is seeded from the game's seed and the stream's name, so one
+    subsystem drawing more or fewer numbers doesn't change what the others
+    get. Effects are only run while drawing, so they get their own stream to
+    keep the frame rate from leaking into the simulation.
+    """
+
+    NAMES = ('effects', 'humans', 'particles')
+
+    def __init__(self, seed):
+        self.seed = seed
+        for name in self.NAMES:
+            setattr(self, name, random.Random('{}:{}'.format(seed, name)))
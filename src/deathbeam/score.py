@@ -39,7 +39,6 @@ class Score(object):
         self.you_died2.color = (0, 0, 0, 255)
         self.you_died2.anchor_x = 'center'
         self.you_died2.anchor_y = 'center'
-        self.died = False
         self.reset()
 
     def add(self, name, value, why=None):
@@ -97,6 +96,7 @@ class Score(object):
             getattr(self, name + '_label').draw()
 
     def reset(self):
+        self.died = False
         for name in self.VALUES:
             self.set(name, 0)
             getattr(self, name + '_label').color = (255, 255, 255, 255)
@@ -0,0 +1,104 @@
+from __future__ import absolute_import
+
+
+class SlotMap(object):
+
+    """SlotMap is an unordered container with constant time add and remove.
+
+    Items are packed into a list, so iterating over them is as quick as
+    iterating over a list. Removing an item moves the last item into the
+    hole it leaves, so the order only changes for that one item.
+
+    :meth:`add` returns a handle for the item, which :meth:`get` turns back
+    into the item for as long as it's in the container. A handle is a
+    ``(slot, generation)`` tuple. The slot's generation goes up every time an
+    item is removed from it, so a stale handle never finds whichever item
+    reused the slot.
+    """
+
+    def __init__(self):
+        self.items = []
+        self._item_slots = []  # the slot for each entry in items
+        self._slot_indexes = []  # the index into items for each slot
+        self._slot_generations = []
+        self._free_slots = []
+        self._slots_by_item = {}
+
+    def __contains__(self, item):
+        return item in self._slots_by_item
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, item):
+        """Add an item to the container.
+
+        :returns: Handle for the item.
+        """
+        if self._free_slots:
+            slot = self._free_slots.pop()
+            self._slot_indexes[slot] = len(self.items)
+        else:
+            slot = len(self._slot_indexes)
+            self._slot_indexes.append(len(self.items))
+            self._slot_generations.append(0)
+        self.items.append(item)
+        self._item_slots.append(slot)
+        self._slots_by_item[item] = slot
+        return (slot, self._slot_generations[slot])
+
+    def clear(self):
+        self.__init__()
+
+    def get(self, handle):
+        """Get the item for a handle.
+
+        :returns: The item, or None if it has been removed.
+        """
+        slot, generation = handle
+        if (slot >= len(self._slot_generations) or
+                self._slot_generations[slot] != generation):
+            return None
+        return self.items[self._slot_indexes[slot]]
+
+    def handle(self, item):
+        """Get the handle for an item, or None if it isn't in the container."""
+        slot = self._slots_by_item.get(item)
+        if slot is None:
+            return None
+        return (slot, self._slot_generations[slot])
+
+    def index(self, item):
+        """Get the position of an item in iteration order.
+
+        :returns: The index, or None if the item isn't in the container.
+        """
+        slot = self._slots_by_item.get(item)
+        if slot is None:
+            return None
+        return self._slot_indexes[slot]
+
+    def remove(self, item):
+        """Remove an item from the container.
+
+        :returns: False if the item wasn't in the container.
+        """
+        slot = self._slots_by_item.pop(item, None)
+        if slot is None:
+            return False
+        index = self._slot_indexes[slot]
+        last_item = self.items.pop()
+        last_slot = self._item_slots.pop()
+        if index < len(self.items):
+            self.items[index] = last_item
+            self._item_slots[index] = last_slot
+            self._slot_indexes[last_slot] = index
+        self._slot_generations[slot] += 1
+        self._free_slots.append(slot)
+        return True
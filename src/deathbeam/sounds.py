@@ -11,7 +11,9 @@ class Sound(object):
 
     def __init__(self, actor, filename, min_distance=10.0, pitch=1.0,
                  volume=1.0):
-        if not defs.SOUND:
+        # Headless games and --no-sound turn sound off for their own game.
+        self.enabled = actor.game.sound
+        if not self.enabled:
             return
         filename = os.path.join(defs.ASSETS_DIR, 'sounds', filename)
         if filename not in Sound.cache:
@@ -24,7 +26,7 @@ class Sound(object):
         self.volume = volume
 
     def play(self):
-        if not defs.SOUND:
+        if not self.enabled:
             return
         m = self.sound.play()
         m.min_distance = self.min_distance
@@ -39,9 +41,9 @@ class AmbientSound(Sound):
 
     def __init__(self, actor, filename, auto_update=True, min_distance=10.0,
                  pitch=1.0, volume=1.0):
-        if not defs.SOUND:
-            return
         super().__init__(actor, filename, min_distance, pitch, volume)
+        if not self.enabled:
+            return
         AmbientSound.sounds.append(self)
         self.auto_update = auto_update
 
@@ -60,15 +62,13 @@ class AmbientSound(Sound):
 
     @classmethod
     def stop_all(cls):
-        if not defs.SOUND:
-            return
         for sound in cls.sounds:
             sound.player.pause()
             del sound
         cls.sounds = []
 
     def update(self, pos=None):
-        if not defs.SOUND:
+        if not self.enabled:
             return
         if pos:
             self.player.position = pos
@@ -77,8 +77,6 @@ class AmbientSound(Sound):
 
     @classmethod
     def update_all(cls):
-        if not defs.SOUND:
-            return
         for sound in cls.sounds:
             if sound.auto_update:
                 sound.update()
@@ -0,0 +1,95 @@
+from __future__ import absolute_import
+
+
+class SpatialHash(object):
+
+    """SpatialHash buckets actors by the map cells that they overlap.
+
+    The buckets are keyed on the same cell coordinates as the map, from
+    Map.get_cxcy_for_xy, so an actor is in every bucket that its bounds
+    touch. Moving an actor only touches the buckets if it has crossed into
+    a different range of cells.
+    """
+
+    def __init__(self, game):
+        self.game = game
+        self.buckets = {}
+        self.ranges = {}
+
+    def __contains__(self, actor):
+        return actor in self.ranges
+
+    def __len__(self):
+        return len(self.ranges)
+
+    def _get_range(self, x, y, width, height):
+        map = self.game.world.map
+        cx0, cy0 = map.get_cxcy_for_xy(x, y)
+        cx1, cy1 = map.get_cxcy_for_xy(x + width, y + height)
+        return cx0, cy0, cx1, cy1
+
+    def _get_keys(self, cell_range):
+        cx0, cy0, cx1, cy1 = cell_range
+        width = self.game.world.map.width
+        for cy in range(cy0, cy1 + 1):
+            for cx in range(cx0, cx1 + 1):
+                yield cy * width + cx
+
+    def add(self, actor):
+        cell_range = self._get_range(actor.x, actor.y, actor.width,
+                                     actor.height)
+        self.ranges[actor] = cell_range
+        buckets = self.buckets
+        for key in self._get_keys(cell_range):
+            if key in buckets:
+                buckets[key].append(actor)
+            else:
+                buckets[key] = [actor]
+
+    def query(self, x, y, width, height):
+        """Find the actors in the buckets that a rectangle touches.
+
+        The actors are only close to the rectangle, and might not overlap
+        it. They're returned in the same order as game.actors, so that
+        collisions are handled in the same order as a full scan would.
+
+        :returns: list of actors.
+        """
+        buckets = self.buckets
+        seen = set()
+        actors = []
+        for key in self._get_keys(self._get_range(x, y, width, height)):
+            bucket = buckets.get(key)
+            if not bucket:
+                continue
+            for actor in bucket:
+                if actor not in seen:
+                    seen.add(actor)
+                    actors.append(actor)
+        if len(actors) > 1:
+            actors.sort(key=self.game.actors.index)
+        return actors
+
+    def remove(self, actor):
+        """Remove an actor.
+
+        :returns: False if the actor wasn't in the hash.
+        """
+        cell_range = self.ranges.pop(actor, None)
+        if cell_range is None:
+            return False
+        buckets = self.buckets
+        for key in self._get_keys(cell_range):
+            bucket = buckets[key]
+            bucket.remove(actor)
+            if not bucket:
+                del buckets[key]
+        return True
+
+    def update(self, actor):
+        """Move an actor to the right buckets for its current position."""
+        cell_range = self._get_range(actor.x, actor.y, actor.width,
+                                     actor.height)
+        if cell_range != self.ranges.get(actor):
+            self.remove(actor)
+            self.add(actor)
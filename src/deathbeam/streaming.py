@@ -0,0 +1,190 @@
+"""Stream big maps in and out of memory a chunk at a time.
+
+A map loaded from a chunked map file keeps a MapStream instead of whole
+grids. Its tiles, types and bounds are ChunkedGrids, which look like the
+usual flat grids, but find each cell in a chunk owned by the stream.
+
+The stream keeps the chunks it has used most recently, up to
+MAP_STREAM_CACHE of them. A background thread reads the chunks that the
+map asks for ahead of time (the ones around the camera and the
+mothership), but anything that isn't there yet when the game needs it is
+read right away. Gameplay never depends on how far the thread has got, so
+games stay deterministic.
+"""
+from __future__ import absolute_import
+import collections
+import logging
+import os
+import queue
+import threading
+
+from . import defs
+
+
+logger = logging.getLogger('deathbeam')
+
+# Positions of the grids in each chunk's MapData
+TILES = 2
+TYPES = 3
+BOUNDS = 4
+
+
+class ChunkedGrid(object):
+
+    """ChunkedGrid is a read-only view of one grid across a map's chunks.
+
+    It's indexed the same way as a flat grid, by ``cy * width + cx``.
+    """
+
+    __slots__ = ('field', 'height', 'size', 'stream', 'width')
+
+    def __init__(self, stream, field):
+        self.field = field
+        self.height = stream.file.height
+        self.size = stream.file.chunk_size
+        self.stream = stream
+        self.width = stream.file.width
+
+    def __getitem__(self, i):
+        cy, cx = divmod(i, self.width)
+        size = self.size
+        chunk = self.stream.get(cx // size, cy // size)
+        return chunk[self.field][(cy % size) * size + cx % size]
+
+    def __len__(self):
+        return self.width * self.height
+
+
+class MapStream(object):
+
+    """MapStream pages the chunks of a chunked map file in and out.
+
+    Everything but the loader thread runs on the main thread, including
+    evicting chunks, so that the map can free their GL buffers too. The
+    thread is started the first time something is prefetched, and again in
+    a process forked after that, which doesn't get a copy of it. close()
+    stops it and closes the file.
+
+    :param on_evict: Called with ``(chunk_x, chunk_y)`` when a chunk is
+        dropped from the cache.
+    """
+
+    def __init__(self, file, on_evict=None, cache_size=None):
+        self.file = file
+        self.size = file.chunk_size
+        self.cache_size = cache_size or defs.MAP_STREAM_CACHE
+        self.on_evict = on_evict
+        self.chunks = collections.OrderedDict()
+        self.last_key = None
+        self.last_chunk = None
+        self.pending = set()
+        self.pid = None
+        self.requests = None
+        self.results = None
+        self.thread = None
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def _add(self, key, chunk):
+        self.chunks[key] = chunk
+        while len(self.chunks) > self.cache_size:
+            old_key, old_chunk = self.chunks.popitem(last=False)
+            if old_key == self.last_key:
+                self.last_key = self.last_chunk = None
+            if self.on_evict:
+                self.on_evict(*old_key)
+
+    def _collect(self):
+        if self.pid != os.getpid():
+            return
+        while True:
+            try:
+                key, chunk = self.results.get_nowait()
+            except queue.Empty:
+                return
+            self.pending.discard(key)
+            if key not in self.chunks:
+                self._add(key, chunk)
+
+    def _load_chunks(self, requests, results):
+        while True:
+            key = requests.get()
+            if key is None:
+                return
+            results.put((key, self.file.read_chunk(*key)))
+
+    def _start_thread(self):
+        # Anything a parent process had asked for is never coming, and its
+        # queues may have been forked while they were locked.
+        self.pending = set()
+        self.pid = os.getpid()
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.thread = threading.Thread(
+            target=self._load_chunks, args=(self.requests, self.results),
+            name='map stream', daemon=True)
+        self.thread.start()
+
+    def cells_of_type(self, cell_type):
+        """Get the index of every cell of a type, in index order."""
+        if cell_type:
+            return list(self.file.type_index[cell_type])
+        # Empty cells aren't in the index, so look through every chunk.
+        indexes = []
+        width = self.file.width
+        for cy in range(self.file.height):
+            for cx in range(width):
+                chunk = self.get(cx // self.size, cy // self.size)
+                if not chunk[TYPES][(cy % self.size) * self.size +
+                                    cx % self.size]:
+                    indexes.append(cy * width + cx)
+        return indexes
+
+    def close(self):
+        """Stop the loader thread and close the file."""
+        if self.pid == os.getpid():
+            self.requests.put(None)
+            self.thread.join()
+        self.pid = self.requests = self.results = self.thread = None
+        self.file.close()
+
+    def get(self, chunk_x, chunk_y):
+        """Get a chunk, reading it now if it isn't loaded yet."""
+        key = (chunk_x, chunk_y)
+        if key == self.last_key:
+            return self.last_chunk
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            self._collect()
+            chunk = self.chunks.get(key)
+            if chunk is None:
+                chunk = self.file.read_chunk(chunk_x, chunk_y)
+                self._add(key, chunk)
+        else:
+            self.chunks.move_to_end(key)
+        self.last_key = key
+        self.last_chunk = chunk
+        return chunk
+
+    def prefetch(self, min_x, min_y, max_x, max_y):
+        """Load a range of chunks in the background.
+
+        Chunks that are already loaded are marked as recently used, so they
+        won't be evicted while they're still wanted.
+        """
+        if self.pid != os.getpid():
+            self._start_thread()
+        self._collect()
+        min_x = max(0, min_x)
+        min_y = max(0, min_y)
+        max_x = min(self.file.chunks_x - 1, max_x)
+        max_y = min(self.file.chunks_y - 1, max_y)
+        for chunk_y in range(min_y, max_y + 1):
+            for chunk_x in range(min_x, max_x + 1):
+                key = (chunk_x, chunk_y)
+                if key in self.chunks:
+                    self.chunks.move_to_end(key)
+                elif key not in self.pending:
+                    self.pending.add(key)
+                    self.requests.put(key)
@@ -1,9 +1,13 @@
 from __future__ import absolute_import
+import array
 import logging
+import math
 import os
 import pyglet
 
-from . import defs, helpers
+from . import defs, mapfile, streaming
+from .map_renderer import MapRenderer
+from .streaming import ChunkedGrid, MapStream
 
 
 logger = logging.getLogger('deathbeam')
@@ -15,6 +19,11 @@ def add(name, tilesets, maps):
     _worlds[name] = World(name, tilesets, maps)
 
 
+def iter_worlds():
+    for world in _worlds.values():
+        yield world
+
+
 def load(game, name):
     global _worlds
     world = _worlds.get(name)
@@ -25,25 +34,77 @@ def load(game, name):
 
 class Map(object):
 
+    """A grid of cells, stored as flat arrays.
+
+    Cell (cx, cy) is at index ``cy * width + cx``, where cy counts up from
+    the bottom row. tiles holds each cell's tileset index (0 for no tile),
+    types its map specific type (0-255) and bounds its edge bitmask.
+
+    The grids come from the lists of rows in a Tile Studio export, if the
+    map was given any. Otherwise they're read from ``assets/<name>.dbm``,
+    which scripts/convert_maps makes from an export. If that's a chunked
+    map file, the grids are ChunkedGrids, and the map is streamed in by a
+    MapStream as it's used, until the map is closed.
+
+    MapCell objects are only made when something asks for a cell, and are
+    kept so that asking again gives back the same one. Streamed maps drop
+    them along with their chunk, so there may be more than one MapCell for
+    a cell over time.
+    """
+
     def __init__(self, **kwargs):
         self.loaded = False
+        self.renderer = None
+        self.stream = None
+        self.stream_filename = None
         self.world = None
         for kw in kwargs:
             setattr(self, kw, kwargs[kw])
 
+    def close(self):
+        """Stop streaming the map, and close its file.
+
+        This does nothing for maps that aren't streamed. Streamed maps open
+        their file again the next time they're loaded.
+        """
+        if self.stream is None:
+            return
+        self.stream.close()
+        self.stream = None
+        self.cells.clear()
+        if self.renderer:
+            self.renderer.forget(0, 0, self.width - 1, self.height - 1)
+
     def draw(self):
         game = self.world.game
+        if self.renderer is None:
+            self.renderer = MapRenderer(self)
         min_x, min_y = self.get_cxcy_for_xy(
             game.camera_x - self.tileset.tile_width,
             game.camera_y - self.tileset.tile_height)
         max_x, max_y = self.get_cxcy_for_xy(
             game.camera_x + game.camera_width + self.tileset.tile_width,
             game.camera_y + game.camera_height + self.tileset.tile_height)
-        for y in range(min_y, max_y + 1):
-            for x in range(min_x, max_x + 1):
-                c = self.cells[y][x]
-                if c.tile:
-                    c.draw(game)
+        game.draw.callback(self.renderer.draw, min_x, min_y, max_x, max_y,
+                           z=defs.Z_MAP_BACKGROUND, phase='draw_map')
+
+    def flatten_rows(self):
+        """Turn grids exported from Tile Studio into flat arrays.
+
+        The export has lists of rows from the top of the map, so they're
+        flipped over while flattening them. Bounds are exported as signed
+        bytes, which is why slopes show up as negative numbers.
+        """
+        tiles = array.array('H')
+        types = bytearray()
+        bounds = bytearray()
+        for y in range(self.height - 1, -1, -1):
+            tiles.extend(self.tiles[y])
+            types.extend(self.types[y])
+            bounds.extend(b & 0xff for b in self.bounds[y])
+        self.tiles = tiles
+        self.types = types
+        self.bounds = bounds
 
     def get_cxcy_for_xy(self, x, y):
         x = int(x / self.tileset.tile_width)
@@ -59,86 +120,366 @@ class Map(object):
         return x, y
 
     def get_for_type(self, type):
-        return self.cells_by_type.get(type, [])
+        if self.stream is not None:
+            width = self.width
+            return [self.get_for_cxcy(i % width, i // width)
+                    for i in self.stream.cells_of_type(type)]
+        cells = []
+        types = self.types
+        width = self.width
+        i = types.find(type)
+        while i != -1:
+            cells.append(self.get_for_cxcy(i % width, i // width))
+            i = types.find(type, i + 1)
+        return cells
 
     def get_for_cxcy(self, x, y):
         if x < 0 or x >= self.width or y < 0 or y >= self.height:
             return None
-        return self.cells[y][x]
+        i = y * self.width + x
+        cell = self.cells.get(i)
+        if cell is None:
+            cell = self.cells[i] = MapCell(self, x, y)
+        return cell
 
     def get_for_xy(self, x, y):
         x = int(x / self.tileset.tile_width)
         y = int(y / self.tileset.tile_height)
         if x < 0 or x >= self.width or y < 0 or y >= self.height:
             return None
-        return self.cells[y][x]
+        i = y * self.width + x
+        cell = self.cells.get(i)
+        if cell is None:
+            cell = self.cells[i] = MapCell(self, x, y)
+        return cell
 
     def load(self, world):
+        if self.loaded:
+            # The grids never change once they're built, so reuse them.
+            if self.stream_filename and self.stream is None:
+                self._load_stream(self.stream_filename)
+            self.reset()
+            return
         logging.info('loading %s.map:%s', world.name, self.name)
-        if not self.loaded:
-            self.world = world
-            self.tileset = self.world.tilesets[self.tileset]
-        self.cells = []
-        self.cells_by_type = {}
-        for y in range(self.height - 1, -1, -1):
-            row = []
-            for x in range(self.width):
-                tile = self.tiles[y][x]
-                if tile > 0:
-                    tile = self.tileset.tiles[tile - 1]
-                else:
-                    tile = None
-                cx = x
-                cy = self.height - y - 1
-                cell = MapCell(self, cx, cy,
-                               self.tileset.tile_width * cx,
-                               self.tileset.tile_height * cy,
-                               self.tileset.tile_width,
-                               self.tileset.tile_height,
-                               tile, self.types[y][x], self.bounds[y][x])
-                if cell.type not in self.cells_by_type:
-                    self.cells_by_type[cell.type] = []
-                self.cells_by_type[cell.type].append(cell)
-                row.append(cell)
-            self.cells.append(row)
+        self.world = world
+        self.tileset = self.world.tilesets[self.tileset]
+        filename = os.path.join(defs.ASSETS_DIR, self.name + '.dbm')
+        if hasattr(self, 'tiles'):
+            self.flatten_rows()
+        elif mapfile.is_chunked(filename):
+            self._load_stream(filename)
+        else:
+            self._load_file(filename)
+        self.cells = {}
+        self.metadata = {}
         self.loaded = True
 
-    def trace(self, old_x, old_y, new_x, new_y):
-        new_cell = self.get_for_xy(new_x, new_y)
-        if not new_cell:
-            return (new_x, new_y, False, False, None)
-        old_cell = self.get_for_xy(old_x, old_y)
-        if not old_cell:
-            return (new_x, new_y, False, False, new_cell)
-        return new_cell.trace(old_cell, old_x, old_y, new_x, new_y)
+    def _check_size(self, filename, width, height):
+        if width != self.width or height != self.height:
+            raise ValueError('{} is {}x{}, but {} should be {}x{}'.format(
+                filename, width, height, self.name, self.width,
+                self.height))
+
+    def _load_file(self, filename):
+        data = mapfile.read(filename)
+        self._check_size(filename, data.width, data.height)
+        self.tiles = data.tiles
+        self.types = data.types
+        self.bounds = data.bounds
+
+    def _load_stream(self, filename):
+        file = mapfile.ChunkedMapFile(filename)
+        self._check_size(filename, file.width, file.height)
+        self.stream = MapStream(file, on_evict=self._on_chunk_evicted)
+        self.stream_filename = filename
+        self.tiles = ChunkedGrid(self.stream, streaming.TILES)
+        self.types = ChunkedGrid(self.stream, streaming.TYPES)
+        self.bounds = ChunkedGrid(self.stream, streaming.BOUNDS)
+
+    def _on_chunk_evicted(self, chunk_x, chunk_y):
+        # Let go of everything that was made for the chunk's cells, except
+        # for metadata that actors have actually stored on them.
+        size = self.stream.size
+        width = self.width
+        cells = self.cells
+        metadata = self.metadata
+        for cy in range(chunk_y * size,
+                        min(self.height, (chunk_y + 1) * size)):
+            row = cy * width
+            for i in range(row + chunk_x * size,
+                           row + min(width, (chunk_x + 1) * size)):
+                cells.pop(i, None)
+                if i in metadata and not metadata[i]:
+                    del metadata[i]
+        if self.renderer:
+            self.renderer.forget(chunk_x * size, chunk_y * size,
+                                 (chunk_x + 1) * size - 1,
+                                 (chunk_y + 1) * size - 1)
+
+    def raycast(self, x0, y0, x1, y1):
+        """Find the first cell that blocks a line through the map.
+
+        See raycast_many.
+
+        :returns: ``(cell, x, y)`` for the first cell hit, and the point
+            where the line hit it, or None if nothing was in the way.
+        """
+        return self.raycast_many(((x0, y0, x1, y1),))[0]
+
+    def raycast_many(self, rays):
+        """Find the first cell that blocks each of a list of lines.
+
+        This walks the cells that each line passes through, in order, and
+        stops at the first edge it crosses that would stop a moving actor.
+        That's the same one-way edges that sweep() uses, so a line can
+        leave a cell through an edge that it couldn't have come in through.
+        Slopes block a line wherever it enters them. The cell a line starts
+        in never blocks it.
+
+        :param rays: Iterable of ``(x0, y0, x1, y1)``.
+        :returns: List with the same result as raycast() for each line.
+        """
+        tw = self.tileset.tile_width
+        th = self.tileset.tile_height
+        width = self.width
+        height = self.height
+        bounds = self.bounds
+        slope = defs.CELL_EDGE_SLOPE
+        results = []
+        for x0, y0, x1, y1 in rays:
+            dx = x1 - x0
+            dy = y1 - y0
+            # A line that starts on a grid line and heads left or down
+            # starts in the cell on that side of it, or it would cross into
+            # that cell straight away, and could be blocked by it.
+            if dx < 0:
+                cx = math.ceil(x0 / tw) - 1
+            else:
+                cx = math.floor(x0 / tw)
+            if dy < 0:
+                cy = math.ceil(y0 / th) - 1
+            else:
+                cy = math.floor(y0 / th)
+            # How far along the line (0.0-1.0) the next grid line in each
+            # direction is, and how far it is between grid lines.
+            if dx > 0:
+                step_x = 1
+                edge_x = defs.CELL_EDGE_LEFT
+                t_x = ((cx + 1) * tw - x0) / dx
+                t_delta_x = tw / dx
+            elif dx < 0:
+                step_x = -1
+                edge_x = defs.CELL_EDGE_RIGHT
+                t_x = (cx * tw - x0) / dx
+                t_delta_x = tw / -dx
+            else:
+                t_x = math.inf
+            if dy > 0:
+                step_y = 1
+                edge_y = defs.CELL_EDGE_BOTTOM
+                t_y = ((cy + 1) * th - y0) / dy
+                t_delta_y = th / dy
+            elif dy < 0:
+                step_y = -1
+                edge_y = defs.CELL_EDGE_TOP
+                t_y = (cy * th - y0) / dy
+                t_delta_y = th / -dy
+            else:
+                t_y = math.inf
+            result = None
+            while True:
+                # Prefer the floor or ceiling on a corner, like sweep().
+                if t_y <= t_x:
+                    t = t_y
+                    if t > 1.0:
+                        break
+                    cy += step_y
+                    t_y += t_delta_y
+                    edge = edge_y
+                else:
+                    t = t_x
+                    if t > 1.0:
+                        break
+                    cx += step_x
+                    t_x += t_delta_x
+                    edge = edge_x
+                if cx < 0 or cx >= width or cy < 0 or cy >= height:
+                    continue
+                b = bounds[cy * width + cx]
+                if b & edge or b & slope:
+                    result = (self.get_for_cxcy(cx, cy),
+                              x0 + dx * t, y0 + dy * t)
+                    break
+            results.append(result)
+        return results
+
+    def reset(self):
+        """Clear any metadata that actors have stored on the cells."""
+        self.metadata.clear()
+
+    def update(self):
+        """Start loading the chunks that will be needed soon.
+
+        This only does anything for maps that are being streamed. Actors
+        within ACTIVE_RANGE of the camera or the mothership are awake, so
+        every chunk they could touch is asked for before they get there.
+        """
+        if self.stream is None:
+            return
+        game = self.world.game
+        chunk_width = self.stream.size * self.tileset.tile_width
+        chunk_height = self.stream.size * self.tileset.tile_height
+        margin = defs.ACTIVE_RANGE
+        self.stream.prefetch(
+            int((game.camera_x - margin) // chunk_width),
+            int((game.camera_y - margin) // chunk_height),
+            int((game.camera_x + game.camera_width + margin) // chunk_width),
+            int((game.camera_y + game.camera_height + margin) //
+                chunk_height))
+        if game.mothership:
+            self.stream.prefetch(
+                int((game.mothership.x - margin) // chunk_width), 0,
+                int((game.mothership.x + margin) // chunk_width),
+                self.height // self.stream.size)
+
+    def _find_edge_in_column(self, cx, y, height, edge):
+        if cx < 0 or cx >= self.width:
+            return None
+        th = self.tileset.tile_height
+        cy0 = max(0, math.floor(y / th))
+        cy1 = min(self.height - 1,
+                  max(cy0, math.ceil((y + height) / th) - 1))
+        bounds = self.bounds
+        width = self.width
+        for cy in range(cy0, cy1 + 1):
+            b = bounds[cy * width + cx]
+            if b & edge and not b & defs.CELL_EDGE_SLOPE:
+                return self.get_for_cxcy(cx, cy)
+        return None
+
+    def _find_edge_in_row(self, cy, x, width, edge):
+        if cy < 0 or cy >= self.height:
+            return None
+        tw = self.tileset.tile_width
+        cx0 = max(0, math.floor(x / tw))
+        cx1 = min(self.width - 1,
+                  max(cx0, math.ceil((x + width) / tw) - 1))
+        bounds = self.bounds
+        row = cy * self.width
+        for cx in range(cx0, cx1 + 1):
+            b = bounds[row + cx]
+            if b & edge and not b & defs.CELL_EDGE_SLOPE:
+                return self.get_for_cxcy(cx, cy)
+        return None
+
+    def sweep(self, x, y, width, height, dx, dy):
+        """Move a box through the map, and find the first edge it hits.
+
+        This walks the grid lines that the front of the box crosses, in
+        order, and only looks at the cells it's moving into. A box only
+        collides with the edges facing it, so a box moving right can hit the
+        left edge of a cell, a box moving down can hit the top edge, and so
+        on. Boxes that start out overlapping an edge aren't pushed out.
+
+        Slopes never block a sweep. Use MapCell.clip_slope to keep a point
+        above a slope.
+
+        :param float x: Left of the box.
+        :param float y: Bottom of the box.
+        :param float dx: Distance to move right.
+        :param float dy: Distance to move up.
+        :returns: ``(t, normal_x, normal_y, cell)``. t is how far through the
+            move (0.0-1.0) the box touches the edge, the normal points out of
+            the edge that was hit, and cell is the cell it belongs to. If
+            nothing was hit, this returns ``(1.0, 0, 0, None)``.
+        """
+        tw = self.tileset.tile_width
+        th = self.tileset.tile_height
+        hit_x = hit_y = None
+
+        # vertical grid lines crossed by the front of the box
+        if dx > 0:
+            k = math.ceil((x + width) / tw)
+            while k * tw < x + width + dx:
+                t = (k * tw - x - width) / dx
+                cell = self._find_edge_in_column(k, y + dy * t, height,
+                                                 defs.CELL_EDGE_LEFT)
+                if cell:
+                    hit_x = (t, -1, 0, cell)
+                    break
+                k += 1
+        elif dx < 0:
+            k = math.floor(x / tw)
+            while k * tw > x + dx:
+                t = (x - k * tw) / -dx
+                cell = self._find_edge_in_column(k - 1, y + dy * t, height,
+                                                 defs.CELL_EDGE_RIGHT)
+                if cell:
+                    hit_x = (t, 1, 0, cell)
+                    break
+                k -= 1
+
+        # horizontal grid lines crossed by the front of the box
+        if dy > 0:
+            k = math.ceil((y + height) / th)
+            while k * th < y + height + dy:
+                t = (k * th - y - height) / dy
+                if hit_x and t > hit_x[0]:
+                    break
+                cell = self._find_edge_in_row(k, x + dx * t, width,
+                                              defs.CELL_EDGE_BOTTOM)
+                if cell:
+                    hit_y = (t, 0, -1, cell)
+                    break
+                k += 1
+        elif dy < 0:
+            k = math.floor(y / th)
+            while k * th > y + dy:
+                t = (y - k * th) / -dy
+                if hit_x and t > hit_x[0]:
+                    break
+                cell = self._find_edge_in_row(k - 1, x + dx * t, width,
+                                              defs.CELL_EDGE_TOP)
+                if cell:
+                    hit_y = (t, 0, 1, cell)
+                    break
+                k -= 1
+
+        # If both hit at the same time, prefer the floor or ceiling, so that
+        # landing on a corner slides along the ground.
+        if hit_y and (not hit_x or hit_y[0] <= hit_x[0]):
+            return hit_y
+        if hit_x:
+            return hit_x
+        return (1.0, 0, 0, None)
 
 
 class MapCell(object):
 
-    def __init__(self, map, cx, cy, x, y, width, height, tile, type, bounds):
+    """A view of one cell in a Map.
+
+    Everything but the position is read from the map's grids, and metadata
+    is stored on the map, so a cell has no state of its own.
+    """
+
+    __slots__ = ('cx', 'cy', 'index', 'map', 'x', 'y')
+
+    def __init__(self, map, cx, cy):
         self.map = map
         self.cx = cx
         self.cy = cy
-        self.x = x  # x is the left
-        self.y = y  # y is the bottom
-        self.width = width
-        self.height = height
-        self.tile = tile  # tile is the tileset image for this cell
-        self.type = type  # type is a map specific value 0-255
-        self.bounds = bounds  # bounds is an edges bitmask for collision
-        self.edgeLeft = self.bounds & defs.CELL_EDGE_LEFT and True or False
-        self.edgeRight = self.bounds & defs.CELL_EDGE_RIGHT and True or False
-        self.edgeTop = self.bounds & defs.CELL_EDGE_TOP and True or False
-        self.edgeBottom = self.bounds & defs.CELL_EDGE_BOTTOM and True or False
-        self.edgeSlope = self.bounds & defs.CELL_EDGE_SLOPE and True or False
-        self.neighbors = MapCellNeighbors(self, self.cx, self.cy)
-        self.metadata = {}
+        self.index = cy * map.width + cx
+        self.x = map.tileset.tile_width * cx  # x is the left
+        self.y = map.tileset.tile_height * cy  # y is the bottom
 
     def __delitem__(self, name):
-        del self.metadata[name]
+        del self.map.metadata[self.index][name]
 
     def __getitem__(self, name):
-        return self.metadata.get(name)
+        metadata = self.map.metadata.get(self.index)
+        if metadata is None:
+            return None
+        return metadata.get(name)
 
     def __setitem__(self, name, value):
         self.metadata[name] = value
@@ -149,47 +490,85 @@ class MapCell(object):
             (self.cx, self.cy, self.x, self.y, self.width, self.height,
              self.bounds, self.type))
 
-    def draw(self, game, color=None):
-        if not self.type and not (self.bounds & defs.CELL_EDGE_SLOPE):
-            game.draw.quad(self.x, self.y, self.width, self.height,
-                           defs.Z_MAP_BACKGROUND, (0, 0, 0, 1))
-        else:
-            game.draw.callback(self.tile.blit, self.x, self.y,
-                               z=defs.Z_MAP_BACKGROUND)
-
-    def trace(self, old_cell, old_x, old_y, new_x, new_y):
-        hit = hit_ground = False
-        if self.edgeSlope:
-            dx = int(new_x - self.x)
-            dy = int(new_y - self.y)
-            if self.edgeTop:
-                # top-left to bottom-right, y >= h - x
-                if dy <= self.height - dx:
-                    hit = hit_ground = True
-                    new_y = self.y + (self.height - dx)
-            else:
-                # bottom-left to top-right, y >= x
-                if dy <= dx:
-                    hit = hit_ground = True
-                    new_y = self.y + dx + 1
+    @property
+    def bounds(self):
+        """Edges bitmask for collision."""
+        return self.map.bounds[self.index]
+
+    @property
+    def edgeBottom(self):
+        return bool(self.bounds & defs.CELL_EDGE_BOTTOM)
+
+    @property
+    def edgeLeft(self):
+        return bool(self.bounds & defs.CELL_EDGE_LEFT)
+
+    @property
+    def edgeRight(self):
+        return bool(self.bounds & defs.CELL_EDGE_RIGHT)
+
+    @property
+    def edgeSlope(self):
+        return bool(self.bounds & defs.CELL_EDGE_SLOPE)
+
+    @property
+    def edgeTop(self):
+        return bool(self.bounds & defs.CELL_EDGE_TOP)
+
+    @property
+    def height(self):
+        return self.map.tileset.tile_height
+
+    @property
+    def metadata(self):
+        metadata = self.map.metadata.get(self.index)
+        if metadata is None:
+            metadata = self.map.metadata[self.index] = {}
+        return metadata
+
+    @property
+    def neighbors(self):
+        return MapCellNeighbors(self, self.cx, self.cy)
+
+    @property
+    def tile(self):
+        """Tileset image for this cell, or None."""
+        tile = self.map.tiles[self.index]
+        if tile:
+            return self.map.tileset.tiles[tile - 1]
+        return None
+
+    @property
+    def type(self):
+        """Map specific value 0-255."""
+        return self.map.types[self.index]
+
+    @property
+    def width(self):
+        return self.map.tileset.tile_width
+
+    def clip_slope(self, x, y):
+        """Move a point inside this slope cell up onto the slope.
+
+        :returns: ``(y, hit)``, where hit is True if the point was moved.
+        """
+        dx = int(x - self.x)
+        dy = int(y - self.y)
+        if self.edgeTop:
+            # top-left to bottom-right, y >= h - x
+            if dy <= self.height - dx:
+                return self.y + (self.height - dx), True
         else:
-            if self.edgeLeft and self.x > old_cell.x:
-                hit = True
-                new_x = self.x - 1
-            elif self.edgeRight and self.x < old_cell.x:
-                hit = True
-                new_x = self.x + self.width
-            if self.edgeTop and self.y < old_cell.y:
-                hit = hit_ground = True
-                new_y = self.y + self.height
-            elif self.edgeBottom and self.y > old_cell.y:
-                hit = True
-                new_y = self.y - 1
-        return (new_x, new_y, hit, hit_ground, self)
+            # bottom-left to top-right, y >= x
+            if dy <= dx:
+                return self.y + dx + 1, True
+        return y, False
 
 
 class MapCellNeighbors(object):
 
+    __slots__ = ('cell', 'cx', 'cy')
+
     def __init__(self, cell, cx, cy):
         self.cell = cell
         self.cx = cx
@@ -232,8 +611,8 @@ class TileSet(object):
                                                  self.stride)
         self.tiles = [self.image_grid[i]
                       for i in range(len(self.image_grid) - 1, -1, -1)]
-        for tile in self.tiles:
-            helpers.set_nearest(tile.texture)
+        if world.game.atlas:
+            self.tiles = [world.game.atlas.add(tile) for tile in self.tiles]
         self.loaded = True
 
 
@@ -245,6 +624,11 @@ class World(object):
         self.maps = maps
         self.tilesets = tilesets
 
+    def close(self):
+        """Close any files and threads that the maps are holding on to."""
+        for map in self.maps.values():
+            map.close()
+
     def load(self, game):
         self.game = game
         logging.info('loading world: %s', self.name)
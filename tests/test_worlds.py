@@ -0,0 +1,75 @@
+"""Tests for Map.raycast.
+
+Run with ``python -m unittest discover tests``.
+"""
+from __future__ import absolute_import
+import array
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from deathbeam import defs  # noqa: E402
+from deathbeam.worlds import Map, TileSet  # noqa: E402
+
+
+def make_map(rows):
+    """Make a map of 16x16 cells from rows of bounds, top row first."""
+    height = len(rows)
+    width = len(rows[0])
+    map = Map(name='test', width=width, height=height)
+    map.tileset = TileSet(name='test', tile_width=16, tile_height=16)
+    map.tiles = array.array('H', [0] * (width * height))
+    map.types = bytearray(width * height)
+    map.bounds = bytearray(b for row in reversed(rows) for b in row)
+    map.cells = {}
+    map.metadata = {}
+    return map
+
+
+TOP = defs.CELL_EDGE_TOP
+RIGHT = defs.CELL_EDGE_RIGHT
+SOLID = (defs.CELL_EDGE_TOP | defs.CELL_EDGE_LEFT | defs.CELL_EDGE_BOTTOM |
+         defs.CELL_EDGE_RIGHT)
+
+
+class RaycastTest(unittest.TestCase):
+
+    def test_blocked_by_wall(self):
+        map = make_map([
+            [0, 0, 0, 0],
+            [0, 0, SOLID, 0],
+            [SOLID, SOLID, SOLID, SOLID]])
+        cell, x, y = map.raycast(8, 24, 56, 24)
+        self.assertEqual((cell.cx, cell.cy), (2, 1))
+        self.assertEqual((x, y), (32, 24))
+
+    def test_one_way_edges(self):
+        # A floor with only a top edge can be seen up through, not down.
+        map = make_map([
+            [0, 0],
+            [TOP, TOP],
+            [0, 0]])
+        self.assertIsNone(map.raycast(8, 8, 24, 40))
+        cell, x, y = map.raycast(24, 40, 8, 8)
+        self.assertEqual((cell.cx, cell.cy), (1, 1))
+        self.assertEqual((x, y), (20, 32))
+
+    def test_start_on_grid_line(self):
+        # Standing on a platform, looking a little down and off the edge of
+        # it, shouldn't be blocked by the platform's own top edge.
+        map = make_map([
+            [0, 0, 0],
+            [0, TOP, 0]])
+        self.assertIsNone(map.raycast(24, 16, 8, 15.99))
+        self.assertIsNone(map.raycast(24, 16, 40, 12))
+        # The same for a wall's right edge, looking left along it.
+        map = make_map([
+            [0, RIGHT, 0],
+            [0, RIGHT, 0]])
+        self.assertIsNone(map.raycast(32, 24, 31.99, 8))
+        self.assertIsNotNone(map.raycast(40, 24, 8, 24))
+
+
+if __name__ == '__main__':
+    unittest.main()